@@ -0,0 +1,306 @@
+"""Benchmarks for the sbhistory history processing hot paths.
+
+Run from the repository root:
+
+    python3 benchmarks/bench.py                  # run and show the results
+    python3 benchmarks/bench.py --check          # compare against this machine's baseline
+    python3 benchmarks/bench.py --save-baseline  # store the results as this machine's baseline
+    python3 benchmarks/bench.py --only seaward   # run a subset of the benchmarks
+
+Throughput is items processed per second (best of --repeat runs), the speedup is
+over a reference implementation run on the same input when the benchmark has
+one, peak memory is the largest amount allocated by a single run as seen by
+tracemalloc. Absolute
+throughput only compares on the same machine, so benchmarks/baseline.json keeps
+one set of results per machine (host name, architecture, and Python version).
+"""
+
+import argparse
+import asyncio
+import atexit
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbhistory'))
+
+from astral.sun import sun  # noqa: E402
+from astral import LocationInfo  # noqa: E402
+from config import config_from_dict  # noqa: E402
+from dateutil import tz  # noqa: E402
+
+import datasets  # noqa: E402
+import clearsky  # noqa: E402
+import dailyhistory  # noqa: E402
+import production  # noqa: E402
+import seaward  # noqa: E402
+from influx import InfluxDB  # noqa: E402
+from loggerparser import LoggerParser  # noqa: E402
+from sma import STREAM_CHUNK  # noqa: E402
+import aggregate  # noqa: E402
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+SITE = config_from_dict({
+    'name': 'benchmark', 'region': 'benchmark', 'tz': 'America/New_York', 'latitude': 40.0, 'longitude': -75.0,
+})
+SOLAR = config_from_dict({'azimuth': 180.0, 'tilt': 30.0, 'area': 40.0, 'efficiency': 0.15, 'rho': 0.1})
+
+
+class Case:
+    """A benchmark: setup() builds a fresh input (not timed), run(data) is timed.
+
+    reference(data) optionally runs a reference implementation on the same
+    input, the speedup over it doesn't depend on the machine.
+    """
+
+    def __init__(self, setup, run, items, unit, reference=None):
+        self.setup = setup
+        self.run = run
+        self.items = items
+        self.unit = unit
+        self.reference = reference
+
+
+class PointSink:
+    """Stand-in for the InfluxDB class that only counts the points written."""
+
+    enabled = True
+
+    def __init__(self):
+        self.points = 0
+
+    def write_points(self, points, on_written=None):
+        self.points += len(points)
+        if on_written:
+            on_written(True)
+        return True
+
+
+def copy_histories(histories):
+    return [history.copy() for history in histories]
+
+
+def bench_dailyhistory(args):
+    inverters = datasets.daily_history(args.years)
+    start = datetime.datetime.combine(datasets.start_date(args.years), datetime.time(0, 0))
+    items = sum(len(inverter) for inverter in inverters)
+    return Case(lambda: copy_histories(inverters), lambda data: dailyhistory.process(data, start=start),
+                items, 'samples')
+
+
+def bench_production(args):
+    inverters = datasets.daily_history(args.years, null_rate=0.0)
+    start = datetime.datetime.combine(datasets.start_date(args.years), datetime.time(0, 0))
+    stop = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0))
+    items = sum(len(inverter) for inverter in inverters)
+    return Case(lambda: inverters, lambda data: production.process(data, start=start, stop=stop), items, 'samples')
+
+
+def bench_site_total(args):
+    days = datasets.fine_history(args.fine_years)
+    items = sum(len(inverter) for day in days for inverter in day)
+
+    def run(data):
+        for day in data:
+            aggregate.combine(day)
+    return Case(lambda: [copy_histories(day) for day in days], run, items, 'samples')
+
+
+def bench_write_history(args):
+    days = datasets.fine_history(args.fine_years, null_rate=0.0)
+    inverters = []
+    for i in range(len(days[0])):
+        inverter = days[0][i].copy()
+        for day in days[1:]:
+            inverter.extend(day[i])
+        inverters.append(inverter)
+    items = sum(len(inverter) for inverter in inverters)
+    influxdb = InfluxDB()
+    return Case(lambda: copy_histories(inverters),
+                lambda data: influxdb.history_points(data, 'production/total_wh'), items, 'points')
+
+
+def bench_seaward(args):
+    directory = tempfile.mkdtemp(prefix='sbhistory-bench-')
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    items = datasets.seaward_files(directory, args.fine_years)
+    tzinfo = tz.gettz(SITE.tz)
+    return Case(lambda: PointSink(), lambda sink: seaward.process(directory, tzinfo, sink, workers=1), items, 'rows')
+
+
+def bench_seaward_parse(args):
+    directory = tempfile.mkdtemp(prefix='sbhistory-bench-')
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    items = datasets.seaward_files(directory, args.fine_years)
+    contents = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as f:
+            contents.append(f.read())
+    tzinfo = tz.gettz(SITE.tz)
+
+    def run(data):
+        for content in data:
+            seaward.parse(content, tzinfo)
+
+    def reference(data):
+        # The row at a time parser
+        for content in data:
+            seaward.parse_rows(io.StringIO(content.decode(), newline=''), tzinfo)
+    return Case(lambda: contents, run, items, 'rows', reference)
+
+
+def bench_clearsky(args):
+    tzinfo = tz.gettz(SITE.tz)
+    siteinfo = LocationInfo(name=SITE.name, region=SITE.region, timezone=SITE.tz,
+                            latitude=SITE.latitude, longitude=SITE.longitude)
+    first = datasets.start_date(args.years)
+    days = []
+    for day in range((datetime.date.today() - first).days):
+        astral = sun(date=first + datetime.timedelta(days=day), observer=siteinfo.observer, tzinfo=tzinfo)
+        days.append((astral['dawn'], astral['dusk']))
+    items = sum(len(clearsky.day_timestamps(SITE, dawn, dusk)) for dawn, dusk in days)
+
+    def run(data):
+        for dawn, dusk in data:
+            clearsky.global_irradiance(SITE, SOLAR, dawn, dusk)
+    return Case(lambda: days, run, items, 'samples')
+
+
+def bench_logger_parser(args):
+    replies = datasets.logger_replies(args.fine_years)
+    items = sum(reply.count(b'"t":') for reply in replies)
+
+    def run(data):
+        for reply in data:
+            parser = LoggerParser()
+            for i in range(0, len(reply), STREAM_CHUNK):
+                parser.feed(reply[i:i + STREAM_CHUNK])
+            parser.finish()
+    return Case(lambda: replies, run, items, 'records')
+
+
+BENCHMARKS = {
+    'dailyhistory.process': bench_dailyhistory,
+    'production.process': bench_production,
+    'aggregate.combine': bench_site_total,
+    'InfluxDB.write_history': bench_write_history,
+    'seaward.process': bench_seaward,
+    'seaward.parse': bench_seaward_parse,
+    'clearsky.global_irradiance': bench_clearsky,
+    'LoggerParser.feed': bench_logger_parser,
+}
+
+
+def best_time(case, run, repeat):
+    """Best time of 'repeat' runs."""
+    best = None
+    for _ in range(repeat):
+        data = case.setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = run(data)
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(case, repeat):
+    """Best time of 'repeat' runs, the speedup over the reference, and the peak memory of one traced run."""
+    best = best_time(case, case.run, repeat)
+
+    data = case.setup()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        case.run(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {'seconds': best, 'throughput': case.items / best, 'peak_kb': peak / 1024, 'items': case.items}
+    if case.reference:
+        result['speedup'] = best_time(case, case.reference, repeat) / best
+    return result
+
+
+def machine():
+    """Key of this machine's results in the baseline file."""
+    return f"{platform.node()} {platform.machine()} python{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def compare(name, result, baseline, tolerance):
+    """Return a list of regressions against the baseline entry."""
+    previous = baseline.get(name)
+    if not previous:
+        return []
+    regressions = []
+    if 'speedup' in result and 'speedup' in previous and result['speedup'] < previous['speedup'] * (1 - tolerance):
+        regressions.append(f"speedup {result['speedup']:.1f}x vs {previous['speedup']:.1f}x")
+    if result['throughput'] < previous['throughput'] * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput']:.0f}/s vs {previous['throughput']:.0f}/s")
+    if result['peak_kb'] > previous['peak_kb'] * (1 + tolerance):
+        regressions.append(f"peak memory {result['peak_kb']:.0f} KB vs {previous['peak_kb']:.0f} KB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sbhistory benchmarks')
+    parser.add_argument('--years', type=float, default=5, help='years of daily history and irradiance')
+    parser.add_argument('--fine-years', type=float, default=5, help='years of 5 minute history and Seaward data')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark')
+    parser.add_argument('--only', action='append', help='run benchmarks whose name contains this string')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline results file')
+    parser.add_argument('--check', action='store_true', help="fail on a regression against this machine's baseline")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as this machine's baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown/growth before failing')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    key = machine()
+    baseline = baselines.get(key, {}) if args.check else {}
+    if args.check and not baseline:
+        print(f"No baseline for '{key}' in {args.baseline}, use --save-baseline to create one")
+
+    results = {}
+    failed = False
+    print(f"{'benchmark':<28} {'items':>10} {'seconds':>9} {'items/s':>12} {'speedup':>8} {'peak KB':>10}  status")
+    for name, factory in BENCHMARKS.items():
+        if args.only and not any(only in name for only in args.only):
+            continue
+        case = factory(args)
+        result = measure(case, args.repeat)
+        results[name] = result
+        regressions = compare(name, result, baseline, args.tolerance)
+        if regressions:
+            status = 'REGRESSION: ' + ', '.join(regressions)
+        elif args.check:
+            status = 'ok' if name in baseline else 'new'
+        else:
+            status = ''
+        failed = failed or bool(regressions)
+        speedup = f"{result['speedup']:.1f}x" if 'speedup' in result else '-'
+        print(f"{name:<28} {result['items']:>10} {result['seconds']:>9.3f} {result['throughput']:>12.0f} "
+              f"{speedup:>8} {result['peak_kb']:>10.0f}  {status}")
+
+    if args.save_baseline:
+        baselines.setdefault(key, {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baseline for '{key}' saved to {args.baseline}")
+    return 1 if failed and not args.save_baseline else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Synthetic datasets of realistic size for the sbhistory benchmarks."""
+
+import csv
+import datetime
+import json
+import math
+import os
+import random
+
+from series import Series
+
+
+INVERTERS = ['inv-1', 'inv-2', 'inv-3']
+DAILY_WH = [30000, 28000, 21000]
+
+
+def _total_wh(t, daily_wh):
+    """Lifetime energy meter reading at time t, a cosine shaped day from 06:00 to 18:00."""
+    days, seconds = divmod(t, 86400)
+    fraction = min(1.0, max(0.0, (seconds - 21600) / 43200))
+    return int(daily_wh * (days + (1 - math.cos(math.pi * fraction)) / 2))
+
+
+def start_date(years):
+    """First day of a dataset ending today."""
+    return datetime.date.today() - datetime.timedelta(days=int(365.25 * years))
+
+
+def daily_history(years, null_rate=0.01, seed=1):
+    """Daily total Wh history for each inverter (28704 logger) like Inverter.read_history()."""
+    random.seed(seed)
+    first = start_date(years)
+    days = (datetime.date.today() - first).days
+    inverters = []
+    for name, daily_wh in zip(INVERTERS, DAILY_WH):
+        history = Series(name)
+        for day in range(days):
+            dt = datetime.datetime.combine(first + datetime.timedelta(days=day), datetime.time(0, 0))
+            t = int(dt.timestamp())
+            v = None if random.random() < null_rate else _total_wh(t, daily_wh)
+            history.append(t, v)
+        inverters.append(history)
+    return inverters
+
+
+def fine_history_day(date, null_rate=0.01):
+    """One day of 5 minute total Wh history for each inverter (28672 logger)."""
+    start = int(datetime.datetime.combine(date, datetime.time(0, 0)).timestamp()) - 300
+    inverters = []
+    for name, daily_wh in zip(INVERTERS, DAILY_WH):
+        history = Series(name)
+        for t in range(start, start + 86400 + 300, 300):
+            v = None if random.random() < null_rate else _total_wh(t, daily_wh)
+            history.append(t, v)
+        inverters.append(history)
+    return inverters
+
+
+def fine_history(years, null_rate=0.01, seed=1):
+    """A list with one fine_history_day() per day."""
+    random.seed(seed)
+    first = start_date(years)
+    days = (datetime.date.today() - first).days
+    return [fine_history_day(first + datetime.timedelta(days=day), null_rate) for day in range(days)]
+
+
+def logger_replies(years, days_per_reply=14, seed=1):
+    """getLogger replies (bytes) of every inverter's 5 minute history, days_per_reply days each."""
+    days = fine_history(years, seed=seed)
+    replies = []
+    for inverter in range(len(INVERTERS)):
+        for first in range(0, len(days), days_per_reply):
+            records = [
+                {'t': t, 'v': v} for day in days[first:first + days_per_reply] for t, v in day[inverter]
+            ]
+            uid = f"0199-B000000{inverter + 1}"
+            replies.append(json.dumps({'result': {uid: records}}, separators=(',', ':')).encode())
+    return replies
+
+
+def seaward_files(directory, years, seed=1):
+    """Write Seaward Solar Survey CSV files (one per month, 5 minute samples), returns the number of rows."""
+    random.seed(seed)
+    first = start_date(years)
+    last = datetime.date.today()
+    rows = 0
+    date = first
+    writer = None
+    month = None
+    csvfile = None
+    while date < last:
+        if (date.year, date.month) != month:
+            if csvfile:
+                csvfile.close()
+            month = (date.year, date.month)
+            csvfile = open(os.path.join(directory, f"seaward_{date.year}_{date.month:02}.csv"), 'w', newline='')
+            writer = csv.writer(csvfile, delimiter=',', quotechar='|')
+            writer.writerow(['Date', 'Time', 'Irr', 'Irr Unit', 'Tpv', 'Ta', 'Temp Unit'])
+        for minute in range(6 * 60, 20 * 60, 5):
+            irradiance = max(0.0, 1000 * math.sin(math.pi * (minute - 360) / 840))
+            irr = '<1' if irradiance < 1 else f"{irradiance:.0f}"
+            error = random.random() < 0.01
+            tpv = 'ERR' if error else f"{20 + irradiance / 40:.1f}"
+            ta = 'ERR' if error else '15.0'
+            writer.writerow([date.strftime('%d.%m.%y'), f"{minute // 60:02}:{minute % 60:02}", irr, 'W/m2',
+                             tpv, ta, 'C'])
+            rows += 1
+        date += datetime.timedelta(days=1)
+    if csvfile:
+        csvfile.close()
+    return rows
@@ -0,0 +1,73 @@
+"""Combine the history of multiple inverters into a site total."""
+
+import numpy as np
+
+from series import Series
+
+
+def fill_forward(series):
+    """Replace missing values with the last reported value (in place).
+
+    Missing values at the start of the series, or following a zero reading,
+    are left missing.
+    """
+    t, v, valid = series.arrays()
+    if valid.all():
+        return series
+    index = np.where(valid, np.arange(len(valid)), -1)
+    last = np.maximum.accumulate(index)
+    fill = ~valid & (last >= 0)
+    fill[fill] = v[last[fill]] != 0
+    v[fill] = v[last[fill]]
+    valid[fill] = True
+    return series
+
+
+def site_total(inverters, name='site'):
+    """Sum the inverters at every timestamp reported by all of them.
+
+    Series sharing the same timestamps are summed column-wise, otherwise they
+    are aligned with a single sort of the combined timestamps and summed with
+    np.add.reduceat(). Missing values should be filled first.
+    """
+    if not inverters:
+        return Series(name)
+
+    # Fast path, every inverter reported the same increasing timestamps
+    t0 = inverters[0].arrays()[0]
+    if len(t0) and np.all(t0[1:] > t0[:-1]) and all(np.array_equal(t0, i.arrays()[0]) for i in inverters[1:]):
+        values = np.vstack([inverter.arrays()[1] for inverter in inverters])
+        valid = np.vstack([inverter.arrays()[2] for inverter in inverters])
+        complete = valid.all(axis=0)
+        totals = values[:, complete].sum(axis=0)
+        return Series.from_arrays(name, t0[complete], totals, np.ones(len(totals), dtype=np.uint8))
+
+    times = []
+    values = []
+    for inverter in inverters:
+        t, v, valid = inverter.arrays()
+        times.append(t[valid])
+        values.append(v[valid])
+    t = np.concatenate(times)
+    v = np.concatenate(values)
+    if not len(t):
+        return Series(name)
+    order = np.argsort(t, kind='stable')
+    t = t[order]
+    v = v[order]
+
+    starts = np.flatnonzero(np.concatenate(([True], t[1:] != t[:-1])))
+    counts = np.diff(np.append(starts, len(t)))
+    totals = np.add.reduceat(v, starts)
+    complete = counts == len(inverters)
+    valid = np.ones(int(complete.sum()), dtype=np.uint8)
+    return Series.from_arrays(name, t[starts][complete], totals[complete], valid)
+
+
+def combine(inverters, name='site'):
+    """Fill the missing values of each inverter and append the site total if more than one inverter."""
+    for inverter in inverters:
+        fill_forward(inverter)
+    if len(inverters) > 1:
+        inverters.append(site_total(inverters, name))
+    return inverters
@@ -0,0 +1,102 @@
+"""Remember how far each output has been written so reruns only fetch new data."""
+
+import logging
+import threading
+
+import statefile
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+_DEFAULT_CHECKPOINT_FILE = 'sbhistory_checkpoints.json'
+
+# How each output is stored in InfluxDB, used to reconcile the checkpoints with the database
+RECONCILE = {
+    'production': {'measurement': 'production', 'field': 'today', 'tag': '_inverter'},
+    'daily_history': {'measurement': 'production', 'field': 'midnight', 'tag': '_inverter'},
+    'fine_history': {'measurement': 'production', 'field': 'total_wh', 'tag': '_inverter'},
+    'irradiance': {'measurement': 'sun', 'field': 'irradiance', 'tag': '_type'},
+}
+
+
+class Checkpoints:
+    """Class to track the last successfully written timestamp per output and per inverter.
+
+    The checkpoints are kept in a JSON state file that is rewritten after every
+    update, updates arrive from the database writer thread once points are written.
+    A checkpoint stops moving for the rest of the run once a write for it fails,
+    or a read for it is skipped, so it never passes data that still has to be refetched.
+    """
+
+    def __init__(self, filename=None, enabled=True):
+        """Create a new Checkpoints object and load any saved state."""
+        self._filename = statefile.path(filename, _DEFAULT_CHECKPOINT_FILE)
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._state = {}
+        self._failed = set()
+        if enabled:
+            self._state = statefile.load(self._filename, 'checkpoints')
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def get(self, output, name):
+        """Last written timestamp for an inverter (or 'site', 'modeled') or None."""
+        with self._lock:
+            return self._state.get(output, {}).get(name)
+
+    def resume(self, output, names):
+        """Timestamp to resume an output from, the oldest checkpoint of the names or None."""
+        if not self._enabled:
+            return None
+        with self._lock:
+            checkpoints = self._state.get(output, {})
+            values = [checkpoints.get(name) for name in names]
+        if not values or None in values:
+            return None
+        return min(values)
+
+    def update(self, output, name, t):
+        """Record that everything up to t has been written (never moves a checkpoint back)."""
+        if not self._enabled:
+            return
+        with self._lock:
+            if (output, name) in self._failed:
+                return
+            checkpoints = self._state.setdefault(output, {})
+            previous = checkpoints.get(name)
+            if previous is not None and t <= previous:
+                return
+            checkpoints[name] = t
+            self._save()
+
+    def fail(self, output, name, reason='write'):
+        """Record that a write failed (or a 'read' was skipped), the checkpoint stays where it is until the next run."""
+        if not self._enabled:
+            return
+        with self._lock:
+            if (output, name) in self._failed:
+                return
+            self._failed.add((output, name))
+        _LOGGER.warning(f"Checkpoint '{output}/{name}' held back after a failed {reason}")
+
+    def reconcile(self, influxdb, output):
+        """Replace the checkpoints of an output with the last points found in the database."""
+        if not self._enabled:
+            return
+        lookup = RECONCILE.get(output)
+        last = influxdb.query_last(lookup['measurement'], lookup['field'], lookup['tag'])
+        if not last:
+            return
+        with self._lock:
+            checkpoints = self._state.setdefault(output, {})
+            for name, t in last.items():
+                if name is not None and checkpoints.get(name) != t:
+                    _LOGGER.debug(f"Checkpoint '{output}/{name}' reconciled with the database")
+                    checkpoints[name] = t
+            self._save()
+
+    def _save(self):
+        statefile.save(self._filename, self._state, 'checkpoints')
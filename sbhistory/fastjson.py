@@ -0,0 +1,33 @@
+"""JSON decoding through orjson when it is installed, the standard library otherwise."""
+
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+BACKEND = 'orjson' if orjson else 'json'
+
+
+def loads(data):
+    """Decode a JSON document from bytes or str."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Encode an object as a compact JSON string."""
+    if orjson:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def debug_enabled():
+    """True if debug messages are logged, so debug-only serialization can be skipped otherwise."""
+    return _LOGGER.isEnabledFor(logging.DEBUG)
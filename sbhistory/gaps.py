@@ -0,0 +1,115 @@
+"""Find the holes in the database so only the missing history is requested again."""
+
+import logging
+import datetime
+import dateutil.tz
+
+from astral.sun import sun
+from astral import LocationInfo
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+# Seconds between two fine history points
+FINE_INTERVAL = 300
+
+# What each backfilled output looks like in InfluxDB
+OUTPUTS = {
+    'production': {'measurement': 'production', 'field': 'today', 'tag': '_inverter'},
+    'daily_history': {'measurement': 'production', 'field': 'midnight', 'tag': '_inverter'},
+    'fine_history': {'measurement': 'production', 'field': 'total_wh', 'tag': '_inverter'},
+    'irradiance': {'measurement': 'sun', 'field': 'irradiance', 'tag': '_type', 'where': 'modeled'},
+}
+
+
+def dates(start, stop):
+    """List of the dates from start up to and including stop."""
+    days = []
+    date = start
+    while date <= stop:
+        days.append(date)
+        date += datetime.timedelta(days=1)
+    return days
+
+
+def missing_days(counts, names, start, stop):
+    """Dates from start to stop (included) without a single point for at least one of the names."""
+    return [date for date in dates(start, stop) if any(not counts.get(name, {}).get(date) for name in names)]
+
+
+def daylight_slots(site_properties, start, stop):
+    """Return {date: number of 5 minute slots from sunrise to sunset} for the dates from start to stop."""
+    tzinfo = dateutil.tz.gettz(site_properties.tz)
+    siteinfo = LocationInfo(
+        name=site_properties.name,
+        region=site_properties.region,
+        timezone=site_properties.tz,
+        latitude=site_properties.latitude,
+        longitude=site_properties.longitude,
+    )
+    slots = {}
+    for date in dates(start, stop):
+        try:
+            astral = sun(date=date, observer=siteinfo.observer, tzinfo=tzinfo)
+        except ValueError:
+            # The sun doesn't rise or set that day, only the inverters are compared
+            continue
+        # The points are logged on the multiples of 5 minutes
+        sunrise = int(astral['sunrise'].timestamp()) // FINE_INTERVAL
+        sunset = int(astral['sunset'].timestamp()) // FINE_INTERVAL
+        slots[date] = sunset - sunrise
+    return slots
+
+
+def short_days(counts, names, start, stop, expected=None):
+    """Dates where at least one name is missing points.
+
+    The inverters log every 5 minute slot of the day while producing, so a name
+    with fewer points than the daylight slots 'expected' ({date: slots}, see
+    daylight_slots()) has holes in it, and the inverters of a site log the same
+    slots so a name with fewer points than another one has holes too.
+    """
+    expected = expected or {}
+    days = []
+    for date in dates(start, stop):
+        found = [counts.get(name, {}).get(date, 0) for name in names]
+        if min(found) < max(max(found), expected.get(date, 0), 1):
+            days.append(date)
+    return days
+
+
+def windows(days, max_days):
+    """Group sorted dates into (first, last) windows spanning at most max_days days."""
+    results = []
+    for date in days:
+        if results and (date - results[-1][0]).days < max_days:
+            results[-1][1] = date
+        else:
+            results.append([date, date])
+    return [tuple(window) for window in results]
+
+
+def find(influxdb, output, names, start, stop, tz=None, site_properties=None):
+    """Return the sorted list of dates from start to stop (included) with holes in an output.
+
+    Returns None if the database can't be queried, 'tz' is the site timezone the days are counted in,
+    the fine history of each day is checked against its daylight when 'site_properties' is given.
+    """
+    lookup = OUTPUTS.get(output)
+    # The days are the site's local days, the last one searched ends at the following midnight
+    tzinfo = dateutil.tz.gettz(tz) if tz else None
+    following = stop + datetime.timedelta(days=1)
+    first = int(datetime.datetime.combine(start, datetime.time(0, 0), tzinfo=tzinfo).timestamp())
+    last = int(datetime.datetime.combine(following, datetime.time(0, 0), tzinfo=tzinfo).timestamp())
+    counts = influxdb.query_daily_counts(
+        lookup['measurement'], lookup['field'], lookup['tag'], first, last, tz=tz, where=lookup.get('where')
+    )
+    if counts is None:
+        return None
+    if output == 'fine_history':
+        expected = daylight_slots(site_properties, start, stop) if site_properties else None
+        days = short_days(counts, names, start, stop, expected)
+    else:
+        days = missing_days(counts, names, start, stop)
+    _LOGGER.info(f"Found {len(days)} day(s) with missing '{output}' points from {start} to {stop}")
+    return days
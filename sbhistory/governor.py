@@ -0,0 +1,106 @@
+"""Limit how hard the inverters are pushed, per inverter and across the site."""
+
+import asyncio
+import logging
+import time
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+
+class TokenBucket:
+    """Class to pace requests to 'rate' per second with bursts of up to 'burst' requests."""
+
+    def __init__(self, rate, burst=1):
+        """Create a new TokenBucket object, full."""
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class Limiter:
+    """Class to gate the requests to one inverter.
+
+    A request waits for a free slot on the inverter, then for a token from the
+    inverter's bucket, then for a free slot on the site so an inverter being
+    paced doesn't hold up the others. Waiting requests queue in arrival order
+    instead of failing.
+    """
+
+    def __init__(self, name, concurrency=1, rate=None, burst=1, site=None):
+        """Create a new Limiter object."""
+        self.name = name
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._site = site
+        self._in_flight = 0
+        self._peak = 0
+        self._requests = 0
+        self._waited = 0.0
+
+    async def __aenter__(self):
+        queued = time.monotonic()
+        await self._semaphore.acquire()
+        try:
+            if self._bucket:
+                await self._bucket.acquire()
+            if self._site:
+                await self._site.acquire()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self._waited += time.monotonic() - queued
+        self._requests += 1
+        self._in_flight += 1
+        self._peak = max(self._peak, self._in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._in_flight -= 1
+        if self._site:
+            self._site.release()
+        self._semaphore.release()
+
+    def report(self):
+        if not self._requests:
+            return
+        _LOGGER.info(
+            f"Inverter '{self.name}': {self._requests} requests, at most {self._peak} in flight, "
+            f"{self._waited / self._requests * 1000:.0f} ms average queue wait"
+        )
+
+
+class Governor:
+    """Class to hand out the per inverter limiters, all sharing one site-wide limit."""
+
+    def __init__(self, site_concurrency=None, concurrency=1, rate=None, burst=1):
+        """Create a new Governor object, site_concurrency=None means no site-wide limit."""
+        self._site = asyncio.Semaphore(site_concurrency) if site_concurrency else None
+        self._concurrency = concurrency
+        self._rate = rate
+        self._burst = burst
+        self._limiters = []
+
+    def limiter(self, name):
+        """Return a new Limiter for an inverter."""
+        limiter = Limiter(name, self._concurrency, self._rate, self._burst, self._site)
+        self._limiters.append(limiter)
+        return limiter
+
+    def report(self):
+        for limiter in self._limiters:
+            limiter.report()
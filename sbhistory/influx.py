@@ -3,14 +3,23 @@
 # InfluxDB Line Protocol Reference
 # https://docs.influxdata.com/influxdb/v2.0/reference/syntax/line-protocol/
 
+import asyncio
+import datetime
 import logging
 import os
+import queue
+import threading
+import time
+from collections import deque
+import dateutil.tz
 from config import config_from_yaml
 
 from influxdb_client import InfluxDBClient, WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
 
 from exceptions import FailedInitialization
+import metrics
+import progress
 
 
 _LOGGER = logging.getLogger("sbhistory")
@@ -37,10 +46,152 @@ LP_LOOKUP = {
 }
 
 
+# Batched writer defaults, points are flushed when a batch is full or has waited long enough
+WRITER_BATCH_SIZE = 5000
+WRITER_FLUSH_INTERVAL = 1.0
+WRITER_MAX_QUEUE = 50
+
+
+class BatchWriter:
+    """Class to write points to InfluxDB in batches from a background thread.
+
+    Producers queue lists of points, the queue is bounded so producers wait
+    (backpressure) when the database can't keep up.
+    """
+
+    def __init__(self, write_api, bucket, batch_size=WRITER_BATCH_SIZE, flush_interval=WRITER_FLUSH_INTERVAL,
+                 max_queue=WRITER_MAX_QUEUE):
+        """Create a new BatchWriter object and start the writer thread."""
+        self._write_api = write_api
+        self._bucket = bucket
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flushes = 0
+        self._failures = 0
+        self._points = 0
+        self._latency = 0.0
+        self._waits = 0
+        self._thread = threading.Thread(target=self._run, name='influxdb-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, points, on_written=None):
+        """Queue points for writing, blocks while the queue is full.
+
+        on_written(ok) is called from the writer thread once all the points have been handled,
+        ok is False if any of them failed to be written.
+        """
+        if not points:
+            return
+        try:
+            self._queue.put_nowait((points, on_written))
+        except queue.Full:
+            self._waits += 1
+            self._queue.put((points, on_written))
+
+    async def aput(self, points, on_written=None):
+        """Queue points for writing, waits without blocking the event loop while the queue is full."""
+        if not points:
+            return
+        try:
+            self._queue.put_nowait((points, on_written))
+        except queue.Full:
+            self._waits += 1
+            await asyncio.get_running_loop().run_in_executor(None, self._queue.put, (points, on_written))
+
+    def close(self):
+        """Flush any queued points and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        self._pending = []
+        self._markers = deque()
+        self._received = 0
+        self._handled = 0
+        oldest = None
+        while True:
+            timeout = None if oldest is None else max(0.0, oldest + self._flush_interval - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ([], None)
+            if item is None:
+                break
+            points, on_written = item
+            if points:
+                if oldest is None:
+                    oldest = time.monotonic()
+                self._pending.extend(points)
+                if on_written:
+                    self._markers.append([self._received, self._received + len(points), on_written, True])
+                self._received += len(points)
+            while len(self._pending) >= self._batch_size:
+                self._flush_pending(self._batch_size)
+            if self._pending and time.monotonic() - oldest >= self._flush_interval:
+                self._flush_pending(len(self._pending))
+            if not self._pending:
+                oldest = None
+
+        while self._pending:
+            self._flush_pending(self._batch_size)
+
+    def _flush_pending(self, count):
+        """Write the first 'count' pending points and run the callbacks of completed puts."""
+        batch = self._pending[:count]
+        del self._pending[:count]
+        first = self._handled
+        self._handled += len(batch)
+        success = self._flush(batch)
+        for marker in self._markers:
+            if marker[0] >= self._handled:
+                break
+            if not success and marker[1] > first:
+                marker[3] = False
+        while self._markers and self._markers[0][1] <= self._handled:
+            _, _, on_written, ok = self._markers.popleft()
+            try:
+                on_written(ok)
+            except Exception as e:
+                _LOGGER.error(f"BatchWriter on_written() callback failed: {e}")
+
+    def _flush(self, points):
+        start = time.perf_counter()
+        try:
+            self._write_api.write(bucket=self._bucket, record=points, write_precision=WritePrecision.S)
+        except Exception as e:
+            self._failures += 1
+            metrics.count('influx_write_failures_total')
+            _LOGGER.error(f"Database write() call failed in BatchWriter: {e}")
+            return False
+        elapsed = time.perf_counter() - start
+        metrics.observe('influx_write_seconds', elapsed)
+        metrics.count('influx_points_written_total', len(points))
+        self._flushes += 1
+        self._points += len(points)
+        self._latency += elapsed
+        _LOGGER.debug(
+            f"Flushed {len(points)} points in {elapsed * 1000:.0f} ms ({len(points) / max(elapsed, 1e-6):.0f} points/s)"
+        )
+        return True
+
+    def report(self):
+        """Log the writer statistics."""
+        if not self._flushes and not self._failures:
+            return
+        average = self._latency / self._flushes if self._flushes else 0.0
+        throughput = self._points / self._latency if self._latency else 0.0
+        _LOGGER.info(
+            f"InfluxDB writer: {self._points} points in {self._flushes} flushes, {self._failures} failed, "
+            f"average latency {average * 1000:.0f} ms, {throughput:.0f} points/s, {self._waits} producer waits"
+        )
+
+
 class InfluxDB:
     def __init__(self):
         self._client = None
         self._write_api = None
+        self._writer = None
         self._query_api = None
         self._enabled = False
 
@@ -83,16 +234,19 @@ class InfluxDB:
             if not self._write_api:
                 raise Exception(f"Failed to get client write_api() object from {config.url}")
 
-            query_api = self._client.query_api()
-            if not query_api:
+            self._query_api = self._client.query_api()
+            if not self._query_api:
                 raise Exception(f"Failed to get client query_api() object from {config.url}")
             try:
-                query_api.query(f'from(bucket: "{self._bucket}") |> range(start: -1m)')
-                self._enabled = True
-                _LOGGER.info(f"Connected to the InfluxDB database at {config.url}, bucket '{self._bucket}'")
+                self._query_api.query(f'from(bucket: "{self._bucket}") |> range(start: -1m)')
             except Exception:
                 raise Exception(f"Unable to access bucket '{self._bucket}' at {config.url}")
 
+            # The writer thread is only started once the bucket is known to be reachable
+            self._writer = BatchWriter(self._write_api, self._bucket)
+            self._enabled = True
+            _LOGGER.info(f"Connected to the InfluxDB database at {config.url}, bucket '{self._bucket}'")
+
         except Exception as e:
             _LOGGER.error(f"{e}")
             self.stop()
@@ -101,70 +255,142 @@ class InfluxDB:
         return True
 
     def stop(self):
-        if self._enabled:
-            if self._write_api:
-                self._write_api.close()
-                self._write_api = None
-            if self._client:
-                self._client.close()
-                self._client = None
-
-    def write_points(self, points):
+        # Also called when start() fails part way, before the database is enabled
+        self._enabled = False
+        if self._writer:
+            self._writer.close()
+            self._writer.report()
+            self._writer = None
+        if self._write_api:
+            self._write_api.close()
+            self._write_api = None
+        if self._client:
+            self._client.close()
+            self._client = None
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def write_points(self, points, on_written=None):
+        """Queue points for the batch writer, blocks while the writer queue is full.
+
+        on_written(ok) is called once the points are handled, never when the database is disabled.
+        """
         if not self._enabled:
+            # Nothing is written so nothing is reported as written
             return True
 
-        if not self._write_api:
+        if not self._writer:
             return False
-        try:
-            self._write_api.write(bucket=self._bucket, record=points, write_precision=WritePrecision.S)
-            result = True
-        except Exception as e:
-            _LOGGER.error(f"Database write() call failed in write_points(): {e}")
-            result = False
-        return result
+        self._writer.put(points, on_written)
+        progress.written(points)
+        return True
 
-    def write_history(self, site, topic):
+    async def awrite_points(self, points, on_written=None):
+        """Queue points for the batch writer from a coroutine."""
         if not self._enabled:
             return True
 
-        if not self._write_api:
+        if not self._writer:
             return False
+        await self._writer.aput(points, on_written)
+        progress.written(points)
+        return True
+
+    def query_last(self, measurement, field, tag, start='0'):
+        """Return the time (seconds) of the last point of a field for each value of a tag."""
+        if not self._enabled or not self._query_api:
+            return {}
+        query = (
+            f'from(bucket: "{self._bucket}")'
+            f' |> range(start: {start})'
+            f' |> filter(fn: (r) => r._measurement == "{measurement}" and r._field == "{field}")'
+            f' |> group(columns: ["{tag}"])'
+            f' |> last()'
+        )
+        try:
+            tables = self._query_api.query(query)
+        except Exception as e:
+            _LOGGER.error(f"Database query() call failed in query_last(): {e}")
+            return {}
+        results = {}
+        for table in tables:
+            for record in table.records:
+                results[record.values.get(tag)] = int(record.get_time().timestamp())
+        return results
+
+    def query_daily_counts(self, measurement, field, tag, start, stop, tz=None, where=None):
+        """Return {tag value: {date: number of points}} for each local day from start to stop (epoch seconds).
 
+        Days without points are left out, 'where' optionally restricts the tag to one value.
+        """
+        if not self._enabled or not self._query_api:
+            return None
+        location = f'import "timezone"\noption location = timezone.location(name: "{tz}")\n' if tz else ''
+        condition = f' and r.{tag} == "{where}"' if where else ''
+        query = (
+            f'{location}'
+            f'from(bucket: "{self._bucket}")'
+            f' |> range(start: {start}, stop: {stop})'
+            f' |> filter(fn: (r) => r._measurement == "{measurement}" and r._field == "{field}"{condition})'
+            f' |> group(columns: ["{tag}"])'
+            f' |> aggregateWindow(every: 1d, fn: count, createEmpty: false, timeSrc: "_start")'
+        )
+        try:
+            tables = self._query_api.query(query)
+        except Exception as e:
+            _LOGGER.error(f"Database query() call failed in query_daily_counts(): {e}")
+            return None
+        # The buckets start at the site's local midnights, not the host's
+        tzinfo = dateutil.tz.gettz(tz) if tz else None
+        results = {}
+        for table in tables:
+            for record in table.records:
+                date = record.get_time().astimezone(tzinfo).date()
+                results.setdefault(record.values.get(tag), {})[date] = record.get_value()
+        return results
+
+    def history_points(self, site, topic):
+        """Convert inverter histories (Series objects) to line protocol points."""
         lookup = LP_LOOKUP.get(topic, None)
         if not lookup:
             _LOGGER.error(f"write_history(): unknown topic '{topic}'")
-            return False
+            return None
 
         measurement = lookup.get('measurement')
         tags = lookup.get('tags', None)
         field = lookup.get('field', None)
         lps = []
-        for inverter in site:
-            inverter_name = inverter.pop(0)
-            name = inverter_name.get('inverter', 'sunnyboy')
-            for history in inverter:
-                t = history['t']
-                v = history['v']
-                if v is None:
-                    continue
-                lp = f"{measurement}"
+        with metrics.timer('influx_format_seconds', topic=topic):
+            for inverter in site:
+                name = inverter.name or 'sunnyboy'
+                prefix = f"{measurement}"
                 if tags and len(tags):
-                    lp += f",{tags[0]}={name}"
-                if isinstance(v, int):
-                    lp += f" {field}={v}i {t}"
-                    lps.append(lp)
-                else:
-                    _LOGGER.error(
-                        f"write_history(): unanticipated type '{type(v)}' in measurement '{measurement}/{field}'"
-                    )
-                    continue
+                    prefix += f",{tags[0]}={name}"
+                lps.extend(
+                    f"{prefix} {field}={v}i {t}" for t, v, valid in zip(inverter.t, inverter.v, inverter.valid) if valid
+                )
+        metrics.count('influx_points_formatted_total', len(lps), topic=topic)
+        return lps
 
-        try:
-            self._write_api.write(bucket=self._bucket, record=lps, write_precision=WritePrecision.S)
+    def write_history(self, site, topic, on_written=None):
+        if not self._enabled:
             return True
-        except Exception as e:
-            _LOGGER.error(f"Database write() call failed in write_history(): {e}")
+
+        lps = self.history_points(site, topic)
+        if lps is None:
+            return False
+        return self.write_points(lps, on_written)
+
+    async def awrite_history(self, site, topic, on_written=None):
+        if not self._enabled:
+            return True
+
+        lps = self.history_points(site, topic)
+        if lps is None:
             return False
+        return await self.awrite_points(lps, on_written)
 
 
 if __name__ == "__main__":
@@ -1,54 +1,123 @@
 """Code to interface with the SMA inverters and return the results."""
 
+import asyncio
 import logging
+import time
+
+import metrics
 import sma
 
 from exceptions import SmaException
+from governor import Limiter
 
 
 _LOGGER = logging.getLogger('sbhistory')
 
+# Waiting for a free session when the inverter answers 503 (maximum number of sessions reached)
+SESSION_WAIT = 5.0
+SESSION_WAIT_MAX = 60.0
+SESSION_ATTEMPTS = 10
+
 
 class Inverter:
     """Class to encapsulate a single inverter."""
 
-    def __init__(self, name, url, group, password, session):
+    def __init__(self, name, url, group, password, session, limiter=None, cache=None, traffic=None, retry=None):
         """Setup an Inverter class instance."""
         self._name = name
         self._url = url
         self._password = password
         self._group = group
         self._session = session
+        self._cache = cache
+        self._traffic = traffic
+        self._retry = retry
         self._sma = None
+        self._logins = 0
+        self._limiter = limiter or Limiter(name)
 
-    async def initialize(self):
-        """Setup inverter for data collection."""
-        # SMA class object for access to inverters
-        try:
-            self._sma = sma.SMA(session=self._session, url=self._url, password=self._password, group=self._group)
-        except SmaException as e:
-            _LOGGER.debug(f"Inverter error with '{self._url}': '{e.name}'")
-            return {'name': self._url, 'error': e.name}
+    @property
+    def name(self):
+        """Inverter name from the YAML file."""
+        return self._name
+
+    @property
+    def connected(self):
+        """True if the inverter has an active session."""
+        return self._sma is not None and self._sma.sma_sid is not None
+
+    @property
+    def ready(self):
+        """True if the inverter can be read, it logs in on the first request that isn't cached."""
+        return self._sma is not None
+
+    @property
+    def logins(self):
+        """Number of successful logins to this inverter."""
+        return self._logins + (self._sma.logins if self._sma else 0)
+
+    async def initialize(self, login=True):
+        """Setup inverter for data collection, with login=False the session is opened on first use."""
+        # SMA class object for access to inverters, reused if the session was dropped
+        if self._sma is None:
+            try:
+                self._sma = sma.SMA(
+                    session=self._session, url=self._url, password=self._password, group=self._group,
+                    cache=self._cache, traffic=self._traffic, retry=self._retry, name=self._name,
+                )
+            except SmaException as e:
+                _LOGGER.debug(f"Inverter error with '{self._url}': '{e.name}'")
+                return {'name': self._url, 'error': e.name}
+        if not login:
+            return {'name': self._url, 'error': ''}
 
         try:
-            await self._sma.new_session()
+            with metrics.timer('inverter_login_seconds', inverter=self._name):
+                await self._queued(self._sma.new_session)
             _LOGGER.debug(f"Connected to SMA inverter {self._name} at {self._url}")
             return {'name': self._url, 'error': ''}
         except SmaException as e:
             _LOGGER.debug(f"{self._name}, login failed: {e}")
+            metrics.count('inverter_login_failures_total', inverter=self._name)
             return {'name': self._url, 'error': e.name}
 
     async def close(self):
         """Log out of the inverter."""
         if self._sma:
+            self._logins += self._sma.logins
             await self._sma.close_session()
             self._sma = None
 
+    async def _queued(self, request, *args):
+        """Make a request through the limiter, waiting for a free session while the inverter has none."""
+        wait = SESSION_WAIT
+        for _ in range(SESSION_ATTEMPTS - 1):
+            try:
+                async with self._limiter:
+                    return await request(*args)
+            except SmaException as e:
+                if e != SmaException.MAX_SESSIONS:
+                    raise
+            _LOGGER.info(f"Inverter '{self._name}' has no free sessions, waiting {wait:.0f} seconds")
+            await asyncio.sleep(wait)
+            wait = min(2 * wait, SESSION_WAIT_MAX)
+        async with self._limiter:
+            return await request(*args)
+
+    def _observe(self, history_type, begin, history):
+        """Record the time taken by a history read (including any wait for the limiter) and the samples read."""
+        metrics.observe('inverter_read_seconds', time.perf_counter() - begin, inverter=self._name, history=history_type)
+        metrics.count('inverter_samples_total', len(history), inverter=self._name, history=history_type)
+
     async def read_history(self, start, stop):
         """Read the baseline inverter production."""
         try:
-            history = await self._sma.read_history(start, stop)
-            history.insert(0, {'inverter': self._name})
+            begin = time.perf_counter()
+            history = self._sma.cached(sma.KEY_DAILY_HISTORY, start, stop)
+            if history is None:
+                history = await self._queued(self._sma.read_history, start, stop)
+            history.name = self._name
+            self._observe('daily', begin, history)
             return history
         except SmaException as e:
             _LOGGER.error(f"Inverter '{self._url}' read_history(): '{e.name}'")
@@ -57,8 +126,13 @@ class Inverter:
     async def read_fine_history(self, start, stop):
         """Read the baseline inverter production."""
         try:
-            history = await self._sma.read_fine_history(start, stop)
-            history.insert(0, {'inverter': self._name})
+            begin = time.perf_counter()
+            # Only requests that go to the inverter wait for the limiter
+            history = self._sma.cached(sma.KEY_FINE_HISTORY, start, stop)
+            if history is None:
+                history = await self._queued(self._sma.read_fine_history, start, stop)
+            history.name = self._name
+            self._observe('fine', begin, history)
             return history
         except SmaException as e:
             _LOGGER.error(f"Inverter '{self._url}' read_history(): '{e.name}'")
@@ -0,0 +1,125 @@
+"""Model the clear-sky irradiance for a range of days."""
+
+import logging
+import datetime
+from dateutil import tz
+
+from astral.sun import sun
+from astral import LocationInfo
+from config import config_from_dict
+
+import clearsky
+import processpool
+import progress
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+# Days of irradiance modeled by a worker process in one task
+DAYS_PER_CHUNK = 30
+
+# Number of points sent to InfluxDB in one write
+BATCH_SIZE = 5000
+
+
+def day_points(site_properties, solar_properties, start, days):
+    """Generator yielding the date and line protocol points for each modeled day."""
+    tzinfo = tz.gettz(site_properties.tz)
+    siteinfo = LocationInfo(
+        name=site_properties.name,
+        region=site_properties.region,
+        timezone=site_properties.tz,
+        latitude=site_properties.latitude,
+        longitude=site_properties.longitude,
+    )
+
+    date = start
+    for _ in range(days):
+        astral = sun(date=date, observer=siteinfo.observer, tzinfo=tzinfo)
+        timestamps = clearsky.day_timestamps(site_properties, astral['dawn'], astral['dusk'])
+        irradiance = clearsky.global_irradiance_array(site_properties, solar_properties, timestamps)
+        # sample: sun,_type=modeled irradiance=800 1556813561098
+        yield date, [
+            f"sun,_type=modeled irradiance={round(v, 1)} {t}" for t, v in zip(timestamps.tolist(), irradiance.tolist())
+        ]
+        date += datetime.timedelta(days=1)
+
+
+def process_days(site_properties, solar_properties, start, days):
+    """Model the irradiance for a number of days starting at 'start', returns line protocol strings."""
+    return [lp for _, points in day_points(site_properties, solar_properties, start, days) for lp in points]
+
+
+def _process_chunk(site_options, solar_options, start, days):
+    """Worker process entry, Configuration objects don't pickle so the options are passed as dicts."""
+    return process_days(config_from_dict(site_options), config_from_dict(solar_options), start, days)
+
+
+def chunks(start, stop):
+    """Split the days from start up to stop into (start, days) tasks."""
+    tasks = []
+    date = start
+    while date < stop:
+        days = 0
+        first = date
+        while date < stop and days < DAYS_PER_CHUNK:
+            date += datetime.timedelta(days=1)
+            days += 1
+        tasks.append((first, days))
+    return tasks
+
+
+def chunk_points(site_properties, solar_properties, start, stop, workers=None):
+    """Generator yielding (last date, points) for each chunk in date order, the chunks are modeled in a process pool."""
+    site_options = dict(site_properties)
+    solar_options = dict(solar_properties)
+    tasks = (
+        (first + datetime.timedelta(days=days - 1), (site_options, solar_options, first, days))
+        for first, days in chunks(start, stop)
+    )
+    workers = processpool.workers(workers)
+    with processpool.pool(workers) as executor:
+        for last, future in processpool.ordered(executor, workers, _process_chunk, tasks):
+            yield last, future.result()
+
+
+def process(site_properties, solar_properties, start, stop, influxdb, workers=None, on_written=None):
+    """Model the irradiance from start to stop in a process pool, writing fixed size batches as they fill.
+
+    on_written(date, ok) is called once every day up to and including 'date' has been handled by
+    the database writer, ok is False if any of those points failed to be written.
+    """
+    batch = []
+    batches = 0
+    last = None
+    progress.total(len(chunks(start, stop)), 'chunks')
+    for last, points in chunk_points(site_properties, solar_properties, start, stop, workers):
+        batch.extend(points)
+        # A full batch ends inside this chunk unless it takes every remaining point
+        previous = last - datetime.timedelta(days=DAYS_PER_CHUNK)
+        while len(batch) >= BATCH_SIZE:
+            complete = last if len(batch) == BATCH_SIZE else previous
+            batches += write_batch(influxdb, batch[:BATCH_SIZE], complete, on_written)
+            del batch[:BATCH_SIZE]
+        progress.advance()
+    if batch:
+        batches += write_batch(influxdb, batch, last, on_written)
+    _LOGGER.info(f"Queued modeled irradiance in {batches} batch(es) of up to {BATCH_SIZE} points")
+
+
+def write_batch(influxdb, batch, complete, on_written=None):
+    """Hand one batch of points to the database writer, every day up to 'complete' is in this or earlier batches.
+
+    Returns True if the batch was queued, a failed write is reported by the writer thread.
+    """
+    def callback(ok):
+        if not ok:
+            _LOGGER.error(f"A batch of modeled irradiance through {complete.date()} was not written")
+        if on_written:
+            on_written(complete, ok)
+
+    if not influxdb.write_points(batch, callback):
+        _LOGGER.error(f"Failed to queue a batch of modeled irradiance through {complete.date()}")
+        return False
+    _LOGGER.debug(f"Modeled irradiance queued through {complete.date()}")
+    return True
@@ -26,7 +26,7 @@ def check_config(options):
 
 
 def start(config):
-    """Create the application log."""
+    """Create the application log and return its filename."""
 
     log_options = check_config(config)
     if not log_options:
@@ -71,3 +71,4 @@ def start(config):
 
     # First entry
     _LOGGER.info("Created application log %s", filename)
+    return filename
@@ -0,0 +1,136 @@
+"""Incremental parser that turns getLogger replies into Series buffers as the bytes arrive.
+
+A getLogger reply looks like {"result":{"0199-xxxxxxxx":[{"t":1601521200,"v":12345},...]}},
+the complete records in each chunk are decoded together and appended to the
+Series, so only one chunk of records is ever decoded at a time and the reply
+is never held in memory as a whole.
+"""
+
+import re
+
+import fastjson
+from series import Series
+
+
+# Reply up to the start of the records array, group 1 is the device id
+ENVELOPE = re.compile(rb'\s*\{\s*"result"\s*:\s*\{\s*"([^"]+)"\s*:\s*\[')
+ARRAY_START = re.compile(rb'\s*\[')
+# What follows the records array in a reply, and in a bare records array
+REPLY_END = re.compile(rb'\s*\]\s*\}\s*\}\s*')
+ARRAY_END = re.compile(rb'\s*\]\s*')
+
+# Longest run of bytes that can be waiting for the rest of a record
+MAX_PENDING = 1024
+
+
+class FormatError(ValueError):
+    """The reply does not have the expected getLogger layout."""
+
+
+class IncompleteError(FormatError):
+    """The reply ended before the end of the getLogger records, the connection was cut short."""
+
+
+class LoggerParser:
+    """Class to parse a getLogger reply fed in chunks.
+
+    With envelope=True the input is a full reply and anything that isn't a
+    records array (an 'err' reply for instance) is decoded normally by
+    finish(), with envelope=False the input is a bare records array.
+    """
+
+    def __init__(self, name=None, envelope=True):
+        """Create a new LoggerParser object."""
+        self._series = Series(name)
+        self._envelope = envelope
+        self._uid = None
+        self._started = False
+        self._streaming = False
+        self._closed = False
+        self._buffer = b''
+        self.size = 0
+
+    def _start(self):
+        """Find the start of the records array, False while more bytes are needed."""
+        match = (ENVELOPE if self._envelope else ARRAY_START).match(self._buffer)
+        if match is None:
+            if len(self._buffer) < MAX_PENDING:
+                return False
+            if not self._envelope:
+                raise FormatError('Expected a getLogger records array')
+            # Not a records reply, kept whole for a normal decode
+            self._started = True
+            return True
+        if self._envelope:
+            self._uid = match.group(1).decode()
+        self._buffer = self._buffer[match.end():]
+        self._started = self._streaming = True
+        return True
+
+    def feed(self, chunk):
+        """Parse the next chunk of the reply."""
+        self.size += len(chunk)
+        self._buffer += chunk
+        if not self._started and not self._start():
+            return
+        if not self._streaming:
+            return
+
+        if self._closed:
+            if len(self._buffer) > MAX_PENDING:
+                raise FormatError('Unexpected data after the getLogger records')
+            return
+        # Records never contain ']' or nested objects, so the records end at the first ']'
+        # and everything up to the last '}' before it is complete records
+        buffer = self._buffer
+        close = buffer.find(b']')
+        if close >= 0:
+            self._append(buffer[:close])
+            self._buffer = buffer[close:]
+            self._closed = True
+            return
+        end = buffer.rfind(b'}') + 1
+        self._append(buffer[:end])
+        self._buffer = buffer[end:]
+        if len(self._buffer) > MAX_PENDING:
+            raise FormatError('Unexpected getLogger record')
+
+    def _append(self, records):
+        """Decode a run of complete records and add them to the Series."""
+        records = records.strip()
+        if records.startswith(b','):
+            records = records[1:]
+        if not records:
+            return
+        try:
+            decoded = fastjson.loads(b'[' + records + b']')
+            values = [record['v'] for record in decoded]
+            self._series.t.extend([record['t'] for record in decoded])
+            self._series.v.extend([0 if value is None else value for value in values])
+        except (ValueError, TypeError, KeyError, OverflowError) as e:
+            raise FormatError(f"Unexpected getLogger record: {e}")
+        self._series.valid.extend([value is not None for value in values])
+
+    def finish(self):
+        """Return the parsed reply, {'result': {uid: Series}} for a records reply or the decoded JSON."""
+        if not self._started and not self._envelope:
+            raise FormatError('Expected a getLogger records array')
+        if not self._streaming:
+            return fastjson.loads(self._buffer) if self._buffer.strip() else {}
+        end = REPLY_END if self._envelope else ARRAY_END
+        if not self._closed:
+            raise IncompleteError('Unexpected end of getLogger reply')
+        if not end.fullmatch(self._buffer):
+            raise FormatError('Unexpected data after the getLogger records')
+        if not self._envelope:
+            return self._series
+        return {'result': {self._uid: self._series}}
+
+
+def write_records(f, series, batch=4096):
+    """Write a Series to a text file as a getLogger records array."""
+    f.write('[')
+    for i in range(0, len(series), batch):
+        records = zip(series.t[i:i + batch], series.v[i:i + batch], series.valid[i:i + batch])
+        f.write((',' if i else '') + ','.join(f'{{"t":{t},"v":{v if ok else "null"}}}' for t, v, ok in records))
+    f.write(']')
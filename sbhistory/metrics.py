@@ -0,0 +1,222 @@
+"""Timers and counters for a sbhistory run, reported at the end of the run and optionally exported.
+
+Metrics are identified by a name and a set of labels, for instance
+metrics.observe('sma_request_seconds', 0.2, inverter='http://192.168.1.2', endpoint='getLogger').
+The exports are a JSON document and a Prometheus text file (for the node
+exporter textfile collector) so the throughput can be tracked across runs.
+"""
+
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+# Prefix of the metric names in the Prometheus export
+PROMETHEUS_PREFIX = 'sbhistory_'
+
+# Upper bounds (seconds) of the timer histogram buckets, the last bucket is everything slower
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class Timer:
+    """Class to accumulate the durations of one timed operation and their histogram."""
+
+    def __init__(self):
+        """Create a new Timer object."""
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def summary(self):
+        """The non empty histogram buckets as text."""
+        labels = [f"<={bound:g}s" for bound in BUCKETS] + [f">{BUCKETS[-1]:g}s"]
+        return ', '.join(f"{label}: {count}" for label, count in zip(labels, self.histogram) if count)
+
+
+class Metrics:
+    """Class to collect the timers and counters of a run, updates may come from any thread."""
+
+    def __init__(self):
+        """Create a new Metrics object."""
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+        self._started = time.time()
+
+    def observe(self, name, seconds, **labels):
+        """Add a duration to a timer."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = Timer()
+            timer.observe(seconds)
+
+    def count(self, name, value=1, **labels):
+        """Add to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def total(self, name, **labels):
+        """Sum of the counters of a name whose labels include 'labels'."""
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(value for (key, keys), value in self._counters.items() if key == name and wanted <= set(keys))
+
+    def combined(self, name, **labels):
+        """Timer combining the timers of a name whose labels include 'labels'."""
+        wanted = set(labels.items())
+        combined = Timer()
+        with self._lock:
+            for (key, keys), timer in self._timers.items():
+                if key == name and wanted <= set(keys):
+                    combined.merge(timer)
+        return combined
+
+    def values(self, name, label):
+        """Values of a label seen on the counters and timers of a name, in order of appearance."""
+        with self._lock:
+            keys = list(self._counters) + list(self._timers)
+        values = (dict(labels).get(label) for key, labels in keys if key == name)
+        return list(dict.fromkeys(value for value in values if value is not None))
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Time the code run in this context."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Return the metrics as a JSON serializable dict."""
+        with self._lock:
+            timers = [
+                {
+                    'name': name, 'labels': dict(labels), 'count': timer.count, 'seconds': timer.total,
+                    'max': timer.max, 'buckets': list(timer.histogram),
+                }
+                for (name, labels), timer in sorted(self._timers.items())
+            ]
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+        return {'started': self._started, 'finished': time.time(), 'timers': timers, 'counters': counters}
+
+    def report(self):
+        """Log a summary table of the timers and counters."""
+        snapshot = self.snapshot()
+        if not snapshot['timers'] and not snapshot['counters']:
+            return
+        rows = [('timer', 'labels', 'count', 'total s', 'mean ms', 'max ms')]
+        for timer in snapshot['timers']:
+            mean = timer['seconds'] / timer['count'] if timer['count'] else 0.0
+            rows.append((
+                timer['name'], _labels(timer['labels']), str(timer['count']), f"{timer['seconds']:.3f}",
+                f"{mean * 1000:.1f}", f"{timer['max'] * 1000:.1f}",
+            ))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        _LOGGER.info("Run metrics:")
+        for row in rows:
+            _LOGGER.info('  ' + '  '.join(
+                cell.ljust(width) if i < 2 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))
+            ))
+        if snapshot['counters']:
+            rows = [('counter', 'labels', 'value')]
+            rows.extend((c['name'], _labels(c['labels']), f"{c['value']:g}") for c in snapshot['counters'])
+            widths = [max(len(row[i]) for row in rows) for i in range(3)]
+            for row in rows:
+                _LOGGER.info(f"  {row[0].ljust(widths[0])}  {row[1].ljust(widths[1])}  {row[2].rjust(widths[2])}")
+
+    def export_json(self, filename):
+        """Write the metrics to a JSON file."""
+        _write(filename, json.dumps(self.snapshot(), indent=2) + '\n')
+
+    def export_prometheus(self, filename):
+        """Write the metrics in the Prometheus text format, timers become histograms."""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for timer in snapshot['timers']:
+            name = PROMETHEUS_PREFIX + timer['name']
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip([f"{bound:g}" for bound in BUCKETS] + ['+Inf'], timer['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_prometheus_labels(dict(timer['labels'], le=bound))} {cumulative}")
+            labels = _prometheus_labels(timer['labels'])
+            lines.append(f"{name}_sum{labels} {timer['seconds']:.6f}")
+            lines.append(f"{name}_count{labels} {timer['count']}")
+        for counter in snapshot['counters']:
+            name = PROMETHEUS_PREFIX + counter['name']
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_prometheus_labels(counter['labels'])} {counter['value']:g}")
+        name = PROMETHEUS_PREFIX + 'run_duration_seconds'
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {snapshot['finished'] - snapshot['started']:.3f}")
+        name = PROMETHEUS_PREFIX + 'run_finished_timestamp_seconds'
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {snapshot['finished']:.0f}")
+        _write(filename, '\n'.join(lines) + '\n')
+
+
+def _labels(labels):
+    return ', '.join(f"{key}={value}" for key, value in labels.items())
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _write(filename, text):
+    """Replace a file in one step so a collector never reads a partial file."""
+    filename = os.path.abspath(os.path.expanduser(filename))
+    try:
+        temporary = filename + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(text)
+        os.replace(temporary, filename)
+        _LOGGER.info(f"Metrics written to {filename}")
+    except Exception as e:
+        _LOGGER.error(f"Unable to write the metrics to {filename}: {e}")
+
+
+# The metrics of this run, shared by all the modules
+registry = Metrics()
+observe = registry.observe
+count = registry.count
+timer = registry.timer
+total = registry.total
+combined = registry.combined
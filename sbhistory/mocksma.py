@@ -0,0 +1,304 @@
+"""Local stand-in for SMA WebConnect inverters for load and benchmark testing.
+
+Each simulated inverter is served under its own path prefix, e.g. an inverter
+url of 'http://127.0.0.1:8080/inv1' maps '/dyn/login.json' to
+'http://127.0.0.1:8080/inv1/dyn/login.json'.
+
+    python3 mocksma.py --inverters 3 --latency 0.2 --error-rate 0.01
+
+A fraction 'error_rate' of the data requests fail, each with one of the
+'error_modes' picked at random:
+
+    session     the session is dropped and the reply is an error code (401)
+    server      an HTTP 500 reply
+    hang        the reply is held back for 'hang' seconds, longer than any client timeout
+    malformed   the reply is cut off half way, it isn't valid JSON
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import math
+import random
+import secrets
+
+from aiohttp import web
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+KEY_FINE_HISTORY = 28672
+KEY_DAILY_HISTORY = 28704
+
+# Sample spacing for the logger keys
+INTERVALS = {KEY_FINE_HISTORY: 300, KEY_DAILY_HISTORY: 86400}
+
+# Synthetic production model, a cosine shaped day from 06:00 to 18:00 UTC
+SUNRISE = 6 * 3600
+SUNSET = 18 * 3600
+EPOCH = 1420070400
+
+ERROR_MODES = ['session', 'server', 'hang', 'malformed']
+
+# Seconds a 'hang' error holds the reply back
+HANG_SECONDS = 60.0
+
+
+class MockInverter:
+    """Class to simulate a single inverter."""
+
+    def __init__(self, name, daily_wh, max_sessions, null_rate):
+        """Create a new MockInverter object."""
+        self.name = name
+        self.uid = f"0199-{random.randint(0x1000000, 0x7ffffff):08X}"
+        self.daily_wh = daily_wh
+        self.max_sessions = max_sessions
+        self.null_rate = null_rate
+        self.sessions = set()
+        self.lock = asyncio.Lock()
+        self.requests = 0
+
+    def total_wh(self, t):
+        """Lifetime energy meter reading at time t."""
+        days, seconds = divmod(t - EPOCH, 86400)
+        if seconds <= SUNRISE:
+            fraction = 0.0
+        elif seconds >= SUNSET:
+            fraction = 1.0
+        else:
+            fraction = (1 - math.cos(math.pi * (seconds - SUNRISE) / (SUNSET - SUNRISE))) / 2
+        return int(self.daily_wh * (days + fraction))
+
+    def logger(self, key, start, end):
+        """Logger records for the key between start and end (inclusive)."""
+        if key == KEY_DAILY_HISTORY:
+            date = datetime.datetime.fromtimestamp(start).date()
+            t = int(datetime.datetime.combine(date, datetime.time(0, 0)).timestamp())
+            times = []
+            while t <= end:
+                if t >= start:
+                    times.append(t)
+                date += datetime.timedelta(days=1)
+                t = int(datetime.datetime.combine(date, datetime.time(0, 0)).timestamp())
+        else:
+            interval = INTERVALS[key]
+            first = start + (-start % interval)
+            times = range(first, end + 1, interval)
+        return [
+            {'t': t, 'v': None if self.null_rate and random.random() < self.null_rate else self.total_wh(t)}
+            for t in times
+        ]
+
+
+class MockSMA:
+    """Class to run an aiohttp server simulating one or more SMA inverters."""
+
+    def __init__(self, inverters=1, host='127.0.0.1', port=8080, latency=0.0, latency_per_record=0.0,
+                 error_rate=0.0, null_rate=0.0, max_sessions=4, daily_wh=30000, serialize=True,
+                 error_modes=None, hang=HANG_SECONDS):
+        """Create a new MockSMA object."""
+        self._host = host
+        self._port = port
+        self._latency = latency
+        self._latency_per_record = latency_per_record
+        self._error_rate = error_rate
+        self._error_modes = list(error_modes or ERROR_MODES)
+        for mode in self._error_modes:
+            if mode not in ERROR_MODES:
+                raise ValueError(f"Unknown error mode '{mode}', expected one of {', '.join(ERROR_MODES)}")
+        self._hang = hang
+        self.errors = {mode: 0 for mode in self._error_modes}
+        self._serialize = serialize
+        self._inverters = {
+            f"inv{i + 1}": MockInverter(f"inv{i + 1}", daily_wh, max_sessions, null_rate) for i in range(inverters)
+        }
+        self._runner = None
+
+    @property
+    def urls(self):
+        """Inverter urls to use in the YAML file or with the SMA class."""
+        return [f"http://{self._host}:{self._port}/{name}" for name in self._inverters.keys()]
+
+    @property
+    def requests(self):
+        """Number of requests handled by each inverter."""
+        return {name: inverter.requests for name, inverter in self._inverters.items()}
+
+    async def start(self):
+        """Start the server."""
+        app = web.Application()
+        app.router.add_post('/{inverter}/dyn/login.json', self._login)
+        app.router.add_post('/{inverter}/dyn/logout.json', self._logout)
+        app.router.add_post('/{inverter}/dyn/getLogger.json', self._get_logger)
+        app.router.add_post('/{inverter}/dyn/getValues.json', self._get_values)
+        app.router.add_post('/{inverter}/dyn/getAllOnlValues.json', self._get_all_online_values)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        _LOGGER.info(f"Mock SMA server with {len(self._inverters)} inverter(s) at http://{self._host}:{self._port}")
+
+    async def stop(self):
+        """Stop the server."""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _inverter(self, request):
+        inverter = self._inverters.get(request.match_info['inverter'])
+        if inverter is None:
+            raise web.HTTPNotFound()
+        inverter.requests += 1
+        return inverter
+
+    async def _delay(self, records=0):
+        delay = self._latency + self._latency_per_record * records
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _respond(self, inverter, handler, records=0):
+        """Simulate the single threaded inverter web server."""
+        if self._serialize:
+            async with inverter.lock:
+                await self._delay(records)
+                return handler()
+        await self._delay(records)
+        return handler()
+
+    async def _reply(self, inverter, request, handler, records=0):
+        """Respond to a data request, failing it with a random error mode for error_rate of the requests."""
+        error = None
+        if self._error_rate and random.random() < self._error_rate:
+            error = random.choice(self._error_modes)
+            self.errors[error] += 1
+        if error == 'session':
+            inverter.sessions.discard(request.query.get('sid'))
+        elif error == 'hang':
+            await asyncio.sleep(self._hang)
+        elif error == 'server':
+            return web.Response(status=500, text='Internal Server Error')
+        body = await self._respond(inverter, handler, records)
+        if error == 'malformed':
+            text = json.dumps(body)
+            return web.Response(text=text[:len(text) // 2], content_type='application/json')
+        return web.json_response(body)
+
+    def _check_session(self, inverter, request):
+        if request.query.get('sid') not in inverter.sessions:
+            return {'err': 401}
+        return None
+
+    async def _login(self, request):
+        inverter = self._inverter(request)
+        body = await request.json()
+
+        def handler():
+            if body.get('right') not in ('usr', 'istl') or not body.get('pass'):
+                return {'err': 401}
+            if len(inverter.sessions) >= inverter.max_sessions:
+                return {'err': 503}
+            sid = secrets.token_urlsafe(16)
+            inverter.sessions.add(sid)
+            return {'result': {'sid': sid}}
+        return web.json_response(await self._respond(inverter, handler))
+
+    async def _logout(self, request):
+        inverter = self._inverter(request)
+
+        def handler():
+            inverter.sessions.discard(request.query.get('sid'))
+            return {'result': {'isLogin': False}}
+        return web.json_response(await self._respond(inverter, handler))
+
+    async def _get_logger(self, request):
+        inverter = self._inverter(request)
+        body = await request.json()
+        key = body.get('key')
+        start = int(body.get('tStart', 0))
+        end = int(body.get('tEnd', 0))
+        records = max(0, (end - start) // INTERVALS.get(key, 300))
+
+        def handler():
+            err = self._check_session(inverter, request)
+            if err:
+                return err
+            if key not in INTERVALS:
+                return {'err': 404}
+            return {'result': {inverter.uid: inverter.logger(key, start, end)}}
+        return await self._reply(inverter, request, handler, records)
+
+    async def _get_values(self, request):
+        inverter = self._inverter(request)
+        body = await request.json()
+        keys = body.get('keys', [])
+
+        def handler():
+            err = self._check_session(inverter, request)
+            if err:
+                return err
+            now = int(datetime.datetime.now().timestamp())
+            return {'result': {inverter.uid: {key: {'1': [{'val': inverter.total_wh(now)}]} for key in keys}}}
+        return await self._reply(inverter, request, handler)
+
+    async def _get_all_online_values(self, request):
+        inverter = self._inverter(request)
+
+        def handler():
+            err = self._check_session(inverter, request)
+            if err:
+                return err
+            now = int(datetime.datetime.now().timestamp())
+            power = inverter.total_wh(now) - inverter.total_wh(now - 3600)
+            values = {
+                '6100_40263F00': {'1': [{'val': power}]},
+                '6400_00260100': {'1': [{'val': inverter.total_wh(now)}]},
+            }
+            return {'result': {inverter.uid: values}}
+        return await self._reply(inverter, request, handler)
+
+
+async def serve(args):
+    server = MockSMA(
+        inverters=args.inverters,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        latency_per_record=args.latency_per_record,
+        error_rate=args.error_rate,
+        null_rate=args.null_rate,
+        max_sessions=args.max_sessions,
+        serialize=not args.concurrent,
+        error_modes=args.error_modes.split(',') if args.error_modes else None,
+        hang=args.hang,
+    )
+    await server.start()
+    for url in server.urls:
+        print(url)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock SMA WebConnect inverter server')
+    parser.add_argument('--inverters', type=int, default=1, help='number of simulated inverters')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--latency-per-record', type=float, default=0.0, help='seconds added per logger record')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of the data requests that fail')
+    parser.add_argument('--error-modes', default=None,
+                        help=f"comma separated error modes to pick from (default {','.join(ERROR_MODES)})")
+    parser.add_argument('--hang', type=float, default=HANG_SECONDS, help="seconds a 'hang' error holds a reply")
+    parser.add_argument('--null-rate', type=float, default=0.0, help='fraction of logger records with no value')
+    parser.add_argument('--max-sessions', type=int, default=4, help='sessions per inverter before a 503 reply')
+    parser.add_argument('--concurrent', action='store_true', help='handle requests to an inverter concurrently')
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
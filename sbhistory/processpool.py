@@ -0,0 +1,41 @@
+"""Process pools for the CPU bound stages."""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Tasks submitted ahead per worker process
+TASKS_PER_WORKER = 2
+
+
+def workers(count=None):
+    """Number of worker processes, one per core when not configured."""
+    return count or os.cpu_count() or 1
+
+
+def pool(count):
+    """Return a ProcessPoolExecutor whose workers don't inherit the state of this process.
+
+    The pools are created from the scheduler threads while the event loop, the
+    database writer, and the logging handlers are running, a forked child
+    could deadlock on a lock held by one of those threads.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=count, mp_context=multiprocessing.get_context(method))
+
+
+def ordered(executor, count, function, tasks):
+    """Generator yielding (context, future) in task order for an iterable of (context, args) tasks.
+
+    Only TASKS_PER_WORKER tasks per worker are submitted ahead of the one
+    being consumed, so the memory used doesn't depend on the number of tasks.
+    """
+    pending = deque()
+    for context, args in tasks:
+        pending.append((context, executor.submit(function, *args)))
+        if len(pending) >= TASKS_PER_WORKER * count:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
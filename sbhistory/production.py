@@ -1,34 +1,116 @@
 """Process daily. monthly, and yearly kWh production."""
 
 import logging
+import datetime
+from bisect import bisect_left, bisect_right
+from dateutil.relativedelta import relativedelta
 
 _LOGGER = logging.getLogger('sbhistory')
 
+PERIODS = ['today', 'month', 'year']
 
-def write(influxdb, points, period):
-    lp_points = []
-    for t, inverter in points.items():
-        for key, value in inverter.items():
-            lp = f"production,_inverter={key} {period}={value} {t}"
-            lp_points.append(lp)
-    return influxdb.write_points(lp_points)
+# Days of daily history requested from an inverter in a single getLogger call
+CHUNK_DAYS = 366
 
 
-def process(inverter_results):
-    results = {}
-    site_wh = 0
+def fetch_range(start, stop):
+    """Return the (start, stop) datetimes of the daily history needed for all the periods."""
+    first = start.replace(month=1, day=1)
+    last = stop.replace(month=1, day=1) + relativedelta(years=1)
+    tomorrow = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0)) + datetime.timedelta(days=1)
+    return first - datetime.timedelta(hours=1), min(last, tomorrow) + datetime.timedelta(hours=2)
+
+
+def chunks(start, stop):
+    """Split the fetch range into (start_ts, stop_ts) windows of at most CHUNK_DAYS days."""
+    windows = []
+    current = start
+    while current < stop:
+        next = min(current + datetime.timedelta(days=CHUNK_DAYS), stop)
+        windows.append((int(current.timestamp()), int(next.timestamp())))
+        current = next
+    return windows
+
+
+def midnights(history):
+    """Map each date to the total Wh meter reading at the midnight that starts it."""
+    readings = {}
+    for t, v in history:
+        if v is None:
+            continue
+        dt = datetime.datetime.fromtimestamp(t)
+        date = dt.date() + datetime.timedelta(days=1) if dt.hour > 12 else dt.date()
+        readings[date] = v
+    return readings
+
+
+def periods(start, stop, period):
+    """Return the list of (begin, end) dates for each period between start and stop."""
+    if period == 'year':
+        current = start.replace(month=1, day=1)
+        step = relativedelta(years=1)
+    elif period == 'month':
+        current = start.replace(day=1)
+        step = relativedelta(months=1)
+    else:
+        current = start
+        step = relativedelta(days=1)
+
+    results = []
+    while current <= stop:
+        results.append((current, current + step))
+        current += step
+    return results
+
+
+def delta(dates, readings, begin, end):
+    """Production between two midnights using the closest readings inside the period."""
+    lo = bisect_left(dates, begin)
+    hi = bisect_right(dates, end) - 1
+    if hi <= lo:
+        return None
+    return readings[dates[hi]] - readings[dates[lo]]
+
+
+def process(inverter_results, start, stop):
+    """Derive the today, month, and year production for every period from the daily history."""
+    series = []
     for inverter in inverter_results:
-        name = inverter[0].get('inverter')
-        if len(inverter) >= 3:
-            start = inverter[1].get('v')
-            end = inverter[-1].get('v')
-            if start is None or end is None:
+        readings = midnights(inverter)
+        series.append((inverter.name, sorted(readings.keys()), readings))
+
+    results = {}
+    for period in PERIODS:
+        combined = {}
+        partial = 0
+        for begin, end in periods(start.date(), stop.date(), period):
+            values = {}
+            site_wh = 0
+            for name, dates, readings in series:
+                wh = delta(dates, readings, begin, end)
+                if wh is None:
+                    # Only this inverter is skipped, the site total is left without it
+                    _LOGGER.debug(f"Inverter '{name}' missing data for {period} starting {begin}")
+                    continue
+                site_wh += wh
+                values[name] = wh / 1000
+            if not values:
                 continue
-            wh = end - start
-            site_wh += wh
-            results[name] = wh / 1000
-        else:
-            _LOGGER.debug(f"Inverter '{name}' missing data ")
-            return None
-    results['site'] = site_wh / 1000
+            if len(values) < len(series):
+                partial += 1
+            values['site'] = site_wh / 1000
+            t = int(datetime.datetime.combine(begin, datetime.time(0, 0)).timestamp())
+            combined[t] = values
+        if partial:
+            _LOGGER.info(f"{partial} '{period}' site total(s) are partial, at least one inverter had no data")
+        results[period] = combined
     return results
+
+
+async def write(influxdb, points, period, on_written=None):
+    lp_points = []
+    for t, inverter in points.items():
+        for key, value in inverter.items():
+            lp = f"production,_inverter={key} {period}={value} {t}"
+            lp_points.append(lp)
+    return await influxdb.awrite_points(lp_points, on_written)
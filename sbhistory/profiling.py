@@ -0,0 +1,157 @@
+"""Optional profiling of a whole sbhistory run, turned on with the --profile switch.
+
+The run is profiled with pyinstrument when it is installed (a sampling profiler,
+pip3 install -e .[profile]), otherwise with cProfile. Memory is traced with
+tracemalloc and a snapshot is taken at each stage boundary, the reports are
+written next to the application log as sbhistory_profile_<date>_<time>.*
+"""
+
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+# Number of functions and allocation sites listed in the reports
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+# The profiler of this run, None when profiling is off
+_active = None
+
+
+class Profiler:
+    """Class to profile a run and trace its memory, mode is 'auto', 'sampling', or 'cprofile'."""
+
+    def __init__(self, directory, mode='auto'):
+        """Create a new Profiler object."""
+        if mode == 'sampling' and pyinstrument is None:
+            _LOGGER.warning("pyinstrument is not installed, profiling with cProfile")
+        self._sampling = mode in ['auto', 'sampling'] and pyinstrument is not None
+        self._prefix = os.path.join(directory, 'sbhistory_profile_' + time.strftime('%Y-%m-%d_%H%M%S'))
+        self._profile = None
+        self._thread_reports = []
+        self._snapshot = None
+        self._memory = None
+
+    def run(self, function, *args):
+        """Run a function under the profiler and write the reports when it returns."""
+        global _active
+        _LOGGER.info(f"Profiling with {'pyinstrument' if self._sampling else 'cProfile'} and tracemalloc")
+        tracemalloc.start()
+        self._memory = open(self._prefix + '_memory.txt', 'w')
+        if self._sampling:
+            self._profile = pyinstrument.Profiler(async_mode='enabled')
+        else:
+            self._profile = cProfile.Profile()
+        _active = self
+        try:
+            if self._sampling:
+                with self._profile:
+                    return function(*args)
+            self._profile.enable()
+            try:
+                return function(*args)
+            finally:
+                self._profile.disable()
+        finally:
+            _active = None
+            self.snapshot('end of run')
+            tracemalloc.stop()
+            self._memory.close()
+            self._write_profile()
+
+    def snapshot(self, label):
+        """Write the top allocations at this point and their growth since the previous snapshot."""
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*'),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"=== {label} at {time.strftime('%H:%M:%S')}: {current / 2**20:.1f} MiB traced, "
+                 f"peak {peak / 2**20:.1f} MiB"]
+        lines.append(f"Top {TOP_ALLOCATIONS} allocation sites:")
+        lines.extend(f"  {stat}" for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS])
+        if self._snapshot is not None:
+            lines.append(f"Top {TOP_ALLOCATIONS} changes since the previous snapshot:")
+            lines.extend(f"  {stat}" for stat in snapshot.compare_to(self._snapshot, 'lineno')[:TOP_ALLOCATIONS])
+        self._snapshot = snapshot
+        self._memory.write('\n'.join(lines) + '\n\n')
+        self._memory.flush()
+        _LOGGER.debug(f"Memory snapshot '{label}': {current / 2**20:.1f} MiB traced")
+
+    def threaded(self, name, function):
+        """Wrap a function run in an executor thread, the profilers only see the thread that started them."""
+        if self._sampling:
+            @functools.wraps(function)
+            def sampled(*args):
+                # pyinstrument sessions of other threads are reported separately
+                profile = pyinstrument.Profiler(async_mode='disabled')
+                with profile:
+                    try:
+                        return function(*args)
+                    finally:
+                        self._thread_reports.append((name, profile))
+            return sampled
+
+        @functools.wraps(function)
+        def wrapper(*args):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Only one cProfile can be active at a time on newer Pythons
+                return function(*args)
+            try:
+                return function(*args)
+            finally:
+                profile.disable()
+                self._thread_reports.append((name, profile))
+        return wrapper
+
+    def _write_profile(self):
+        try:
+            if self._sampling:
+                with open(self._prefix + '.html', 'w') as f:
+                    f.write(self._profile.output_html())
+                with open(self._prefix + '.txt', 'w') as f:
+                    f.write(self._profile.output_text(unicode=True))
+                    for name, profile in self._thread_reports:
+                        f.write(f"\nThread stage '{name}':\n" + profile.output_text(unicode=True))
+            else:
+                # The executor thread stages are merged with the event loop thread
+                stats = pstats.Stats(self._profile)
+                for _, profile in self._thread_reports:
+                    stats.add(profile)
+                stats.dump_stats(self._prefix + '.prof')
+                report = io.StringIO()
+                stats.stream = report
+                stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+                stats.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+                with open(self._prefix + '.txt', 'w') as f:
+                    f.write(report.getvalue())
+            _LOGGER.info(f"Profile written to {self._prefix}.*")
+        except Exception as e:
+            _LOGGER.error(f"Unable to write the profile to {self._prefix}.*: {e}")
+
+
+def snapshot(label):
+    """Take a memory snapshot when the run is being profiled."""
+    if _active is not None:
+        _active.snapshot(label)
+
+
+def threaded(name, function):
+    """Return the function to run in an executor thread, profiled when the run is being profiled."""
+    return function if _active is None else _active.threaded(name, function)
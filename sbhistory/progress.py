@@ -0,0 +1,198 @@
+"""Rate limited progress reporting for the sbhistory stages."""
+
+import contextlib
+import contextvars
+import logging
+import sys
+import threading
+import time
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+# Seconds between updates on a terminal and between progress log lines
+TTY_INTERVAL = 0.5
+LOG_INTERVAL = 30.0
+
+# The stage being run by the current task or thread, None when progress reporting is off
+_stage = contextvars.ContextVar('sbhistory_progress_stage', default=None)
+_reporter = None
+
+
+class Stage:
+    """Class to count the items processed and the bytes written by one stage."""
+
+    def __init__(self, name):
+        """Create a new Stage object."""
+        self.name = name
+        self.unit = 'items'
+        self.total = None
+        self.items = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def rate(self, now):
+        return self.items / max(now - self.started, 1e-9)
+
+    def eta(self, now):
+        """Seconds left at the current rate, None if unknown."""
+        rate = self.rate(now)
+        if not self.total or rate <= 0 or self.items >= self.total:
+            return None
+        return (self.total - self.items) / rate
+
+    def describe(self, now):
+        rate = self.rate(now)
+        text = f"{self.items}"
+        if self.total:
+            text += f"/{self.total} {self.unit} ({100 * self.items / self.total:.0f}%)"
+        else:
+            text += f" {self.unit}"
+        text += f", {rate:.1f} {self.unit}/s"
+        eta = self.eta(now)
+        if eta is not None:
+            text += f", ETA {_duration(eta)}"
+        if self.bytes:
+            text += f", {_size(self.bytes)} written"
+        return text
+
+    def fields(self, now):
+        """The progress as key=value fields for log lines."""
+        fields = {'stage': self.name, 'items': self.items, 'total': self.total, 'unit': self.unit}
+        fields['rate'] = f"{self.rate(now):.2f}"
+        eta = self.eta(now)
+        fields['eta'] = None if eta is None else f"{eta:.0f}"
+        fields['bytes'] = self.bytes
+        fields['elapsed'] = f"{now - self.started:.1f}"
+        return ' '.join(f"{key}={'-' if value is None else value}" for key, value in fields.items())
+
+
+class Reporter:
+    """Class to show the progress of the running stages at most once per 'interval' seconds.
+
+    On a terminal all the running stages share one status line that is
+    redrawn in place, otherwise each running stage is reported with a log line
+    of key=value fields (stage, items, total, unit, rate, eta, bytes, elapsed).
+    """
+
+    def __init__(self, tty, interval=None, stream=None):
+        """Create a new Reporter object."""
+        self._tty = tty
+        self._interval = interval or (TTY_INTERVAL if tty else LOG_INTERVAL)
+        self._stream = stream or sys.stdout
+        self._stages = []
+        self._lock = threading.Lock()
+        self._due = time.monotonic() + self._interval
+        self._width = 0
+
+    def add(self, stage):
+        with self._lock:
+            self._stages.append(stage)
+
+    def remove(self, stage):
+        with self._lock:
+            self._stages.remove(stage)
+            if self._tty:
+                self._draw('')
+        now = time.monotonic()
+        if not stage.items and not stage.bytes:
+            return
+        if self._tty:
+            _LOGGER.info(f"Progress '{stage.name}': {stage.describe(now)}, done in {_duration(now - stage.started)}")
+        else:
+            _LOGGER.info(f"Progress {stage.fields(now)} done=1")
+
+    def update(self):
+        """Show the progress if the last update is old enough."""
+        now = time.monotonic()
+        if now < self._due or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._due = now + self._interval
+            if self._tty:
+                self._draw(' | '.join(f"{stage.name} {stage.describe(now)}" for stage in self._stages))
+            else:
+                for stage in self._stages:
+                    _LOGGER.info(f"Progress {stage.fields(now)} done=0")
+        finally:
+            self._lock.release()
+
+    def _draw(self, line):
+        # The cursor is left at the start of the line so log messages overwrite the status line
+        self._stream.write('\r' + line.ljust(self._width) + '\r')
+        self._stream.flush()
+        self._width = len(line)
+
+
+def configure(enabled=True, mode='auto', interval=None):
+    """Turn progress reporting on or off, mode is 'auto' (a terminal if stdout is one), 'tty', or 'log'."""
+    global _reporter
+    if not enabled:
+        _reporter = None
+        return
+    if mode == 'auto':
+        tty = sys.stdout.isatty()
+    elif mode in ['tty', 'log']:
+        tty = mode == 'tty'
+    else:
+        _LOGGER.error(f"Unknown progress mode '{mode}', expected 'auto', 'tty', or 'log'")
+        tty = False
+    _reporter = Reporter(tty, interval)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Report the progress of a stage for the code run in this context."""
+    if _reporter is None:
+        yield None
+        return
+    reporter = _reporter
+    current = Stage(name)
+    reporter.add(current)
+    token = _stage.set(current)
+    try:
+        yield current
+    finally:
+        _stage.reset(token)
+        reporter.remove(current)
+
+
+def total(count, unit=None):
+    """Add to the number of items the current stage will process, for stages that work through several ranges."""
+    current = _stage.get()
+    if current is None:
+        return
+    current.total = (current.total or 0) + count
+    if unit:
+        current.unit = unit
+
+
+def advance(items=1):
+    """Count items processed by the current stage."""
+    current = _stage.get()
+    if current is None:
+        return
+    current.items += items
+    _reporter.update()
+
+
+def written(points):
+    """Count the line protocol points handed to the database by the current stage."""
+    current = _stage.get()
+    if current is None:
+        return
+    current.bytes += sum(map(len, points)) + len(points)
+    _reporter.update()
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+def _size(count):
+    for unit in ['B', 'KiB', 'MiB']:
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GiB"
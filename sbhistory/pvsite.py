@@ -1,22 +1,34 @@
 """Code to interface with the SMA inverters and return state or history."""
 
 import asyncio
+import functools
 import logging
+import time
 import dateutil
 import datetime
-from dateutil.relativedelta import relativedelta
 from dateutil.parser import isoparse
 
-from astral.sun import sun
-from astral import LocationInfo
-
-import clearsky
+import aggregate
+import gaps
+import irradiance
 import production
 import dailyhistory
+import metrics
+import profiling
+import progress
 import seaward
 
+from governor import Governor
 from inverter import Inverter
 from influx import InfluxDB
+from checkpoint import Checkpoints, RECONCILE
+from retry import RetryPolicy
+from responsecache import ResponseCache, DEFAULT_TTL
+from sessions import SessionManager
+from traffic import Recorder, Player
+from windowing import AdaptiveWindow, aligned_days, DEFAULT_MAX_DAYS, DEFAULT_MAX_RECORDS, DEFAULT_TARGET_SECONDS
+from scheduler import Scheduler
+from series import Series
 
 
 _LOGGER = logging.getLogger('sbhistory')
@@ -33,81 +45,146 @@ class Site:
         """Create a new Site object."""
         self._config = config
         self._influx = InfluxDB()
+        progress.configure(
+            enabled=config.get('sbhistory.progress.enable', True),
+            mode=config.get('sbhistory.progress.mode', 'auto'),
+            interval=config.get('sbhistory.progress.interval', None),
+        )
         self._inverters = []
+        self._governor = Governor(
+            site_concurrency=config.get('sbhistory.settings.site_concurrency', None),
+            concurrency=config.get('sbhistory.settings.inverter_concurrency', 1),
+            rate=config.get('sbhistory.settings.inverter_rate', None),
+            burst=config.get('sbhistory.settings.inverter_burst', 1),
+        )
+        self._retry = RetryPolicy(
+            attempts=config.get('sbhistory.retry.attempts', 3),
+            timeout=config.get('sbhistory.retry.timeout', 3.0),
+            backoff=config.get('sbhistory.retry.backoff', 0.5),
+            backoff_max=config.get('sbhistory.retry.backoff_max', 10.0),
+            jitter=config.get('sbhistory.retry.jitter', 0.5),
+            breaker_threshold=config.get('sbhistory.retry.breaker_threshold', 5),
+            breaker_reset=config.get('sbhistory.retry.breaker_reset', 30.0),
+        )
+        self._cache = None
+        if config.get('sbhistory.cache.enable', False):
+            self._cache = ResponseCache(
+                directory=config.get('sbhistory.cache.path', None),
+                ttl=config.get('sbhistory.cache.ttl', DEFAULT_TTL),
+                compression=config.get('sbhistory.cache.compression', 'gzip'),
+            )
+        self._traffic = None
+        mode = config.get('sbhistory.traffic.mode', None)
+        if mode == 'record':
+            self._traffic = Recorder(config.get('sbhistory.traffic.file', None))
+        elif mode == 'replay':
+            self._traffic = Player(
+                config.get('sbhistory.traffic.file', None), config.get('sbhistory.traffic.timing', 'fast')
+            )
+        elif mode is not None:
+            _LOGGER.error(f"Unknown traffic mode '{mode}', expected 'record' or 'replay'")
         for inverter in config.multisma2.inverters:
             inv = inverter.get('inverter', None)
-            self._inverters.append(Inverter(inv['name'], inv['url'], inv['username'], inv['password'], session))
+            self._inverters.append(
+                Inverter(
+                    inv['name'], inv['url'], inv['username'], inv['password'], session,
+                    limiter=self._governor.limiter(inv['name']), cache=self._cache, traffic=self._traffic,
+                    retry=self._retry,
+                )
+            )
+        self._sessions = SessionManager(self._inverters, lazy=self._cache is not None)
+        self._checkpoints = Checkpoints(
+            filename=config.get('sbhistory.checkpoints.file', None),
+            enabled=config.get('sbhistory.checkpoints.enable', False),
+        )
 
     async def start(self):
         """Initialize the Site object."""
         config = self._config
         if not self._influx.start(config=config.multisma2.influxdb2):
             return False
+        if self._checkpoints.enabled and config.get('sbhistory.checkpoints.reconcile', False):
+            for output in RECONCILE.keys():
+                self._checkpoints.reconcile(self._influx, output)
         return True
 
     async def stop(self):
         """Shutdown the Site object."""
-        await asyncio.gather(*(inverter.close() for inverter in self._inverters))
+        await self._sessions.close()
+        self._sessions.report()
+        self._governor.report()
+        self._retry.report()
+        if self._cache:
+            self._cache.report()
+        if self._traffic:
+            self._traffic.close()
         self._influx.stop()
+        self.report_metrics()
 
-    async def start_inverters(self):
-        inverters = await asyncio.gather(*(inverter.initialize() for inverter in self._inverters))
-        success = True
-        for inverter in inverters:
-            error = inverter.get('error', None)
-            if error is None or len(error) > 0:
-                _LOGGER.error(
-                    f"Connection to inverter '{inverter.get('name')}' failed: {inverter.get('error', 'None')}")
-                success = False
-        if not success:
-            return False
-        return True
-
-    async def stop_inverters(self):
-        await asyncio.gather(*(inverter.close() for inverter in self._inverters))
-
-    async def production_worker(self, start, stop, period):
-        if period == 'year':
-            current = start.replace(month=1, day=1)
-            stop = stop.replace(month=1, day=1) + relativedelta(years=1)
-        elif period == 'month':
-            current = start.replace(day=1)
-            stop = stop.replace(day=1) + relativedelta(months=1)
-        elif period == 'today':
-            current = start
-            stop = stop + relativedelta(days=1)
-        else:
-            _LOGGER.error(f"Unsupported period type: '{period}'")
-            return
-
-        _LOGGER.info(f"Populating '{period}' production values from {current.date()} to {stop.date()}")
-        combined = {}
-        while current < stop:
-            if period == 'year':
-                next = current + relativedelta(years=1)
-            elif period == 'month':
-                next = current + relativedelta(months=1)
-            else:
-                next = current + datetime.timedelta(days=1, hours=2)
-
-            start_ts = int(current.timestamp())
-            stop_ts = int(next.timestamp())
-            if await self.start_inverters():
-                inverters = await asyncio.gather(*(inverter.read_history(start=start_ts, stop=stop_ts) for inverter in self._inverters))
-                await self.stop_inverters()
-            else:
-                return
+    def report_metrics(self):
+        """Log the run metrics and write the exports that are configured."""
+        config = self._config
+        if config.get('sbhistory.metrics.summary', True):
+            metrics.registry.report()
+        if config.get('sbhistory.metrics.json', None):
+            metrics.registry.export_json(config.sbhistory.metrics.json)
+        if config.get('sbhistory.metrics.prometheus', None):
+            metrics.registry.export_prometheus(config.sbhistory.metrics.prometheus)
 
-            results = production.process(inverters)
-            if results is None:
-                _LOGGER.debug(f"{current}: failed to retrieve inverter data")
+    async def start_inverters(self):
+        """Make sure the inverters are logged in, sessions are kept open until stop()."""
+        return await self._sessions.open()
+
+    def resume(self, output, names, start):
+        """Move the start of an output forward to the midnight of its oldest checkpoint."""
+        t = self._checkpoints.resume(output, names)
+        if t is None:
+            return start
+        checkpoint = datetime.datetime.combine(datetime.datetime.fromtimestamp(t).date(), datetime.time(0, 0))
+        if checkpoint <= start:
+            return start
+        _LOGGER.info(f"Resuming '{output}' from the checkpoint at {checkpoint.date()}")
+        return checkpoint
+
+    def checkpoint(self, output, inverters):
+        """Return a callback that records the last timestamp of each series once it is written."""
+        last = {inverter.name: inverter.t[-1] for inverter in inverters if len(inverter)}
+
+        def on_written(ok):
+            for name, t in last.items():
+                self.update_checkpoints(output, [name], t, ok)
+        return on_written
+
+    def update_checkpoints(self, output, names, t, ok=True):
+        """Record the same last written timestamp for several names, or hold them back after a failed write."""
+        for name in names:
+            if ok:
+                self._checkpoints.update(output, name, t)
             else:
-                combined[start_ts] = results
-
-            current = current + datetime.timedelta(days=1) if period == 'today' else next
-            print('.', end='', flush=True)
-        print()
-        production.write(influxdb=self._influx, points=combined, period=period)
+                self._checkpoints.fail(output, name)
+
+    def hold_checkpoints(self, output, names):
+        """Keep checkpoints where they are for the rest of the run after data for them couldn't be read."""
+        for name in names:
+            self._checkpoints.fail(output, name, 'read')
+
+    async def read_daily_history(self, start, stop):
+        """Read the daily history for the range in large chunks, one series per inverter."""
+        windows = production.chunks(start, stop)
+        histories = [Series(inverter.name) for inverter in self._inverters]
+        progress.total(len(windows), 'requests')
+        for start_ts, stop_ts in windows:
+            inverters = await asyncio.gather(
+                *(inverter.read_history(start=start_ts, stop=stop_ts) for inverter in self._inverters)
+            )
+            if None in inverters:
+                _LOGGER.error("At least one inverter failed to return the daily history")
+                return None
+            for history, inverter in zip(histories, inverters):
+                history.extend(inverter)
+            progress.advance()
+        _LOGGER.info(f"Daily history retrieved using {len(windows)} request(s) per inverter")
+        return histories
 
     async def populate_production(self, config):
         if not config.sbhistory.production.enable:
@@ -122,9 +199,26 @@ class Site:
             _LOGGER.error(f"Unexpected exception: {e}")
             return
 
-        periods = ['today', 'month', 'year']
-        for period in periods:
-            await self.production_worker(start, stop, period)
+        names = [inverter.name for inverter in self._inverters] + ['site']
+        start = self.resume('production', names, start)
+        fetch_start, fetch_stop = production.fetch_range(start, stop)
+        _LOGGER.info(f"Populating production values from {start.date()} to {stop.date()}")
+        if not await self.start_inverters():
+            return
+        inverters = await self.read_daily_history(fetch_start, fetch_stop)
+        if inverters is None:
+            self.hold_checkpoints('production', names)
+            return
+
+        with metrics.timer('process_seconds', step='production'):
+            results = production.process(inverters, start=start, stop=stop)
+        for period, points in results.items():
+            _LOGGER.info(f"Writing {len(points)} '{period}' production values")
+            on_written = None
+            if period == 'today' and points:
+                last = max(points.keys())
+                on_written = functools.partial(self.update_checkpoints, 'production', points[last].keys(), last)
+            await production.write(influxdb=self._influx, points=points, period=period, on_written=on_written)
 
     async def populate_daily_history(self, config):
         if not config.sbhistory.daily_history.enable:
@@ -139,6 +233,7 @@ class Site:
             print(e)
             return
 
+        start = self.resume('daily_history', [inverter.name for inverter in self._inverters], start)
         start = start - datetime.timedelta(hours=1)
         stop += datetime.timedelta(days=1)
         _LOGGER.info(f"Populating daily history values from {start.date()} to {stop.date()}")
@@ -150,12 +245,17 @@ class Site:
                     for inverter in self._inverters
                 )
             )
-            await self.stop_inverters()
         else:
             return
+        if None in inverters:
+            _LOGGER.warning("Skipping the daily history, at least one inverter failed to respond")
+            self.hold_checkpoints('daily_history', [inverter.name for inverter in self._inverters])
+            return
 
-        inverters = dailyhistory.process(inverters, start=start)
-        self._influx.write_history(inverters, 'production/midnight')
+        with metrics.timer('process_seconds', step='dailyhistory'):
+            inverters = dailyhistory.process(inverters, start=start)
+        on_written = self.checkpoint('daily_history', inverters)
+        await self._influx.awrite_history(inverters, 'production/midnight', on_written)
 
     async def populate_fine_history(self, config):
         if not config.sbhistory.fine_history.enable:
@@ -163,7 +263,9 @@ class Site:
         recent = config.sbhistory.fine_history.start.lower() == 'recent'
         try:
             if not recent:
-                date = datetime.date.fromisoformat(config.sbhistory.fine_history.start)
+                date = origin = datetime.date.fromisoformat(config.sbhistory.fine_history.start)
+                start = datetime.datetime.combine(date, datetime.time(0, 0))
+                date = self.resume('fine_history', [inverter.name for inverter in self._inverters], start).date()
             else:
                 date = datetime.date.today()
         except Exception as e:
@@ -177,116 +279,124 @@ class Site:
         else:
             _LOGGER.info(f"Populating fine history values from {date} to {end_date}")
 
-        if await self.start_inverters():
-            while date < end_date:
-                if recent:
-                    now = datetime.datetime.now()
-                    start = datetime.datetime.combine(date, now.time()) - datetime.timedelta(minutes=120)
+        if not await self.start_inverters():
+            return
+        if recent:
+            inverters = await self.read_fine_day(date, recent)
+            if inverters is None:
+                _LOGGER.warning("Skipping the recent fine history, at least one inverter failed to respond")
+                return
+            await self._influx.awrite_history(inverters, 'production/total_wh')
+            return
+
+        windows = [
+            AdaptiveWindow(
+                inverter.name,
+                max_days=config.get('sbhistory.fine_history.window.max_days', DEFAULT_MAX_DAYS),
+                target=config.get('sbhistory.fine_history.window.target', DEFAULT_TARGET_SECONDS),
+                max_records=config.get('sbhistory.fine_history.window.max_records', DEFAULT_MAX_RECORDS),
+                timed=self._cache is None and self._traffic is None,
+            )
+            for inverter in self._inverters
+        ]
+        progress.total((end_date - date).days, 'days')
+        while date < end_date:
+            # Every inverter is asked for the same window so the site total lines up
+            days = aligned_days((date - origin).days, min(window.days for window in windows), (end_date - date).days)
+            start = datetime.datetime.combine(date, datetime.time(0, 0)) - datetime.timedelta(minutes=5)
+            stop = start + datetime.timedelta(days=days)
+            results = await asyncio.gather(
+                *(self.timed_fine_history(inverter, start, stop) for inverter in self._inverters)
+            )
+            for window, (history, elapsed) in zip(windows, results):
+                if history is None:
+                    window.failed(days)
                 else:
-                    start = datetime.datetime.combine(date, datetime.time(0, 0)) - datetime.timedelta(minutes=5)
-                stop = start + delta
-
-                total = {}
-                count = {}
-                # if await self.start_inverters():
-                inverters = await asyncio.gather(
-                    *(
-                        inverter.read_fine_history(start=int(start.timestamp()), stop=int(stop.timestamp()))
-                        for inverter in self._inverters
-                    )
-                )
-                if None in inverters:
-                    _LOGGER.debug(f"At least one inverter failed to respond")
+                    window.observe(days, elapsed, len(history))
+            inverters = [history for history, _ in results]
+            if None in inverters:
+                if days > 1:
                     continue
-                # await self.stop_inverters()
-
-                for inverter in inverters:
-                    print('.', end='', flush=True)
-                    last_non_null = None
-                    for i in range(1, len(inverter)):
-                        t = inverter[i]['t']
-                        v = inverter[i]['v']
-
-                        # Handle any missing data points
-                        if v is None:
-                            if not last_non_null:
-                                continue
-                            v = last_non_null
-                            inverter[i]['v'] = last_non_null
-                        total[t] = v + total.get(t, 0)
-                        count[t] = count.get(t, 0) + 1
-                        last_non_null = v
-
-                # Site output if multiple inverters
-                if len(inverters) > 1:
-                    site_total = []
-                    for t, v in total.items():
-                        if count[t] == len(inverters):
-                            site_total.append({'t': t, 'v': v})
-                    site_total.insert(0, {'inverter': 'site'})
-                    inverters.append(site_total)
-
-                self._influx.write_history(inverters, 'production/total_wh')
+                _LOGGER.warning(f"Skipping the fine history for {date}, at least one inverter failed to respond")
+                # A later window must not move the checkpoint past this day
+                self.hold_checkpoints('fine_history', [inverter.name for inverter in self._inverters])
                 date += delta
-            print()
-        await self.stop_inverters()
+                progress.advance()
+                continue
+
+            with metrics.timer('process_seconds', step='aggregate'):
+                inverters = aggregate.combine(inverters)
+            await self._influx.awrite_history(
+                inverters, 'production/total_wh', self.checkpoint('fine_history', inverters)
+            )
+            date += datetime.timedelta(days=days)
+            progress.advance(days)
+        for window in windows:
+            window.report()
+
+    async def timed_fine_history(self, inverter, start, stop):
+        """Read the 5 minute history from one inverter, returns (Series or None, seconds taken)."""
+        begin = time.perf_counter()
+        history = await inverter.read_fine_history(start=int(start.timestamp()), stop=int(stop.timestamp()))
+        return history, time.perf_counter() - begin
+
+    async def read_fine_day(self, date, recent=False):
+        """Read the 5 minute history of one day and add the site total, None if an inverter failed."""
+        if recent:
+            now = datetime.datetime.now()
+            start = datetime.datetime.combine(date, now.time()) - datetime.timedelta(minutes=120)
+        else:
+            start = datetime.datetime.combine(date, datetime.time(0, 0)) - datetime.timedelta(minutes=5)
+        stop = start + datetime.timedelta(days=1)
+
+        inverters = await asyncio.gather(
+            *(
+                inverter.read_fine_history(start=int(start.timestamp()), stop=int(stop.timestamp()))
+                for inverter in self._inverters
+            )
+        )
+        if None in inverters:
+            return None
+        return aggregate.combine(inverters)
 
-    async def populate_irradiance(self, config):
+    def populate_irradiance(self, config):
         if not config.sbhistory.irradiance.enable:
             return
         try:
             date = datetime.datetime.fromisoformat(config.sbhistory.irradiance.start)
+            date = self.resume('irradiance', ['modeled'], date)
             site_properties = config.multisma2.site
             solar_properties = config.multisma2.solar_properties
-
-            tzinfo = dateutil.tz.gettz(site_properties.tz)
-            siteinfo = LocationInfo(
-                name=site_properties.name,
-                region=site_properties.region,
-                timezone=site_properties.tz,
-                latitude=site_properties.latitude,
-                longitude=site_properties.longitude,
-            )
+            workers = config.sbhistory.irradiance.get('workers', None)
         except Exception as e:
             print(e)
             return
 
         try:
-            delta = datetime.timedelta(days=1)
-            end_date = datetime.datetime.today() + delta
+            end_date = datetime.datetime.today() + datetime.timedelta(days=1)
             _LOGGER.info(f"Populating irradiance values from {date.date()} to {end_date.date()}")
-
-            lp_points = []
-            while date < end_date:
-                print('.', end='', flush=True)
-                astral = sun(date=date, observer=siteinfo.observer, tzinfo=tzinfo)
-                dawn = astral['dawn']
-                dusk = astral['dusk']
-                irradiance = clearsky.global_irradiance(site_properties, solar_properties, dawn, dusk)
-                for point in irradiance:
-                    t = point['t']
-                    v = point['v']
-                    # sample: sun,_type=modeled irradiance=800 1556813561098
-                    lp = f"sun,_type=modeled irradiance={round(v, 1)} {t}"
-                    lp_points.append(lp)
-                date += delta
-
-            print()
-            self._influx.write_points(lp_points)
+            irradiance.process(
+                site_properties, solar_properties, date, end_date, self._influx, workers=workers,
+                on_written=lambda last, ok: self.update_checkpoints(
+                    'irradiance', ['modeled'], int(last.timestamp()), ok
+                ),
+            )
         except Exception as e:
             _LOGGER.error(f"An exception occurred in populate_irradiance(): {e}")
 
-    async def populate_seaward(self, config):
+    def populate_seaward(self, config):
         if not config.sbhistory.seaward.enable:
             return
         try:
             site_properties = config.multisma2.site
             tzinfo = dateutil.tz.gettz(site_properties.tz)
             directory = config.sbhistory.seaward.path
+            manifest = seaward.Manifest(config.get('sbhistory.seaward.manifest', None))
+            workers = config.get('sbhistory.seaward.workers', None)
         except Exception as e:
             _LOGGER.error(f"An exception occurred in populate_seaward(): {e}")
             return
-        seaward.process(directory, tzinfo, self._influx)
+        seaward.process(directory, tzinfo, self._influx, manifest=manifest, workers=workers)
 
     async def populate_patches(self, config):
         try:
@@ -324,17 +434,139 @@ class Site:
                 # sample: production,_inverter=site today=800.0 1556813561098
                 lp = f"{measurement},_inverter={inverter} {field}={db_value}{db_type} {ts}"
                 lp_points.append(lp)
-                self._influx.write_points(lp_points)
+                await self._influx.awrite_points(lp_points)
             except Exception as e:
                 _LOGGER.error(f"An exception occurred in populate_patches(): {e}")
 
         return
 
+    def backfill_range(self, config):
+        """Return the first and last dates searched for holes."""
+        options = config.sbhistory.backfill
+        start = datetime.date.fromisoformat(options.start)
+        if options.get('stop', None):
+            stop = datetime.date.fromisoformat(options.stop)
+        else:
+            # Today is still being written
+            stop = datetime.date.today() - datetime.timedelta(days=1)
+        return start, stop
+
+    def find_gaps(self, config, output, names):
+        start, stop = self.backfill_range(config)
+        site_properties = config.multisma2.site
+        return gaps.find(
+            self._influx, output, names, start, stop, tz=site_properties.tz, site_properties=site_properties
+        )
+
+    async def backfill_inverters(self, config):
+        """Request the inverter history again only for the days missing from the database."""
+        outputs = config.sbhistory.backfill.get('outputs', list(gaps.OUTPUTS.keys()))
+        names = [inverter.name for inverter in self._inverters]
+        requests = 0
+        if 'fine_history' in outputs:
+            requests += await self.backfill_fine_history(self.find_gaps(config, 'fine_history', names))
+        if 'daily_history' in outputs:
+            requests += await self.backfill_daily_history(self.find_gaps(config, 'daily_history', names))
+        if 'production' in outputs:
+            requests += await self.backfill_production(self.find_gaps(config, 'production', names + ['site']))
+        _LOGGER.info(f"Backfill made {requests} history request(s) per inverter")
+
+    async def backfill_fine_history(self, days):
+        if not days or not await self.start_inverters():
+            return 0
+        # Counted in requests like the daily history read by the same stage
+        progress.total(len(days), 'requests')
+        for date in days:
+            progress.advance()
+            inverters = await self.read_fine_day(date)
+            if inverters is None:
+                _LOGGER.warning(f"Unable to backfill the fine history for {date}, an inverter failed to respond")
+                continue
+            await self._influx.awrite_history(inverters, 'production/total_wh')
+        return len(days)
+
+    async def backfill_daily_history(self, days):
+        if not days or not await self.start_inverters():
+            return 0
+        requests = 0
+        wanted = {int(datetime.datetime.combine(date, datetime.time(0, 0)).timestamp()) for date in days}
+        for first, last in gaps.windows(days, production.CHUNK_DAYS - 1):
+            start = datetime.datetime.combine(first, datetime.time(0, 0)) - datetime.timedelta(hours=1)
+            stop = datetime.datetime.combine(last, datetime.time(0, 0)) + datetime.timedelta(days=1)
+            requests += len(production.chunks(start, stop))
+            inverters = await self.read_daily_history(start, stop)
+            if inverters is None:
+                continue
+            with metrics.timer('process_seconds', step='dailyhistory'):
+                inverters = dailyhistory.process(inverters, start=start)
+            holes = []
+            for inverter in inverters:
+                hole = Series(inverter.name)
+                for t, v in inverter:
+                    if t in wanted and v is not None:
+                        hole.append(t, v)
+                holes.append(hole)
+            await self._influx.awrite_history(holes, 'production/midnight')
+        return requests
+
+    async def backfill_production(self, days):
+        if not days or not await self.start_inverters():
+            return 0
+        requests = 0
+        wanted = {int(datetime.datetime.combine(date, datetime.time(0, 0)).timestamp()) for date in days}
+        for first, last in gaps.windows(days, production.CHUNK_DAYS - 1):
+            start = datetime.datetime.combine(first, datetime.time(0, 0))
+            stop = datetime.datetime.combine(last, datetime.time(0, 0))
+            fetch_start, fetch_stop = production.fetch_range(start, stop)
+            requests += len(production.chunks(fetch_start, fetch_stop))
+            inverters = await self.read_daily_history(fetch_start, fetch_stop)
+            if inverters is None:
+                continue
+            with metrics.timer('process_seconds', step='production'):
+                results = production.process(inverters, start=start, stop=stop)
+            today = {t: values for t, values in results.get('today', {}).items() if t in wanted}
+            await production.write(influxdb=self._influx, points=today, period='today')
+            for period in ['month', 'year']:
+                await production.write(influxdb=self._influx, points=results.get(period, {}), period=period)
+        return requests
+
+    def backfill_irradiance(self, config):
+        """Model the irradiance again for the days missing from the database."""
+        outputs = config.sbhistory.backfill.get('outputs', list(gaps.OUTPUTS.keys()))
+        if 'irradiance' not in outputs:
+            return
+        days = self.find_gaps(config, 'irradiance', ['modeled'])
+        site_properties = config.multisma2.site
+        solar_properties = config.multisma2.solar_properties
+        for date in days or []:
+            start = datetime.datetime.combine(date, datetime.time(0, 0))
+            self._influx.write_points(irradiance.process_days(site_properties, solar_properties, start, 1))
+
     async def run(self):
         config = self._config
-        await self.populate_production(config)
-        await self.populate_irradiance(config)
-        await self.populate_seaward(config)
-        await self.populate_daily_history(config)
-        await self.populate_fine_history(config)
-        await self.populate_patches(config)
+        scheduler = Scheduler()
+        profiling.snapshot('start of stages')
+
+        if config.get('sbhistory.backfill.enable', False):
+            # Only fill the holes found in the database
+            scheduler.add_cpu_stage('backfill_irradiance', self.backfill_irradiance, config)
+            scheduler.add_stage('backfill_inverters', self.backfill_inverters, config)
+            await scheduler.run()
+            profiling.snapshot('after backfill')
+            scheduler.report()
+            return
+
+        # Irradiance and Seaward never touch the inverters and overlap with the inverter stages
+        scheduler.add_cpu_stage('irradiance', self.populate_irradiance, config)
+        scheduler.add_cpu_stage('seaward', self.populate_seaward, config)
+        scheduler.add_stage('production', self.populate_production, config)
+        scheduler.add_stage('daily_history', self.populate_daily_history, config)
+        scheduler.add_stage('fine_history', self.populate_fine_history, config)
+        await scheduler.run()
+        profiling.snapshot('after irradiance, seaward, production, daily_history, fine_history')
+
+        # Patches must be applied after everything else is written
+        scheduler.add_stage('patches', self.populate_patches, config)
+        await scheduler.run()
+        profiling.snapshot('after patches')
+        scheduler.report()
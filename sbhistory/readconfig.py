@@ -267,14 +267,22 @@ def check_config(config):
                               {'fine_history': {'required': True, 'keys': [
                                   {'enable': {'required': True, 'keys': [], 'type': bool}},
                                   {'start': {'required': True, 'keys': [], 'type': str}},
+                                  {'window': {'required': False, 'keys': [
+                                      {'max_days': {'required': False, 'keys': [], 'type': int}},
+                                      {'target': {'required': False, 'keys': [], 'type': float}},
+                                      {'max_records': {'required': False, 'keys': [], 'type': int}},
+                                  ]}},
                               ]}},
                               {'irradiance': {'required': True, 'keys': [
                                   {'enable': {'required': True, 'keys': [], 'type': bool}},
                                   {'start': {'required': True, 'keys': [], 'type': str}},
+                                  {'workers': {'required': False, 'keys': [], 'type': int}},
                               ]}},
                               {'seaward': {'required': False, 'keys': [
                                   {'enable': {'required': False, 'keys': [], 'type': bool}},
                                   {'path': {'required': False, 'keys': [], 'type': str}},
+                                  {'manifest': {'required': False, 'keys': [], 'type': str}},
+                                  {'workers': {'required': False, 'keys': [], 'type': int}},
                               ]}},
                               {'patches': {'required': False, 'keys': [
                                   {'patch': {'required': True, 'keys': [
@@ -285,6 +293,53 @@ def check_config(config):
                                       {'value': {'required': True, 'keys': [], 'type': str}},
                                   ]}},
                               ]}},
+                              {'settings': {'required': False, 'keys': [
+                                  {'inverter_concurrency': {'required': False, 'keys': [], 'type': int}},
+                                  {'site_concurrency': {'required': False, 'keys': [], 'type': int}},
+                                  {'inverter_rate': {'required': False, 'keys': [], 'type': float}},
+                                  {'inverter_burst': {'required': False, 'keys': [], 'type': int}},
+                              ]}},
+                              {'metrics': {'required': False, 'keys': [
+                                  {'summary': {'required': False, 'keys': [], 'type': bool}},
+                                  {'json': {'required': False, 'keys': [], 'type': str}},
+                                  {'prometheus': {'required': False, 'keys': [], 'type': str}},
+                              ]}},
+                              {'progress': {'required': False, 'keys': [
+                                  {'enable': {'required': False, 'keys': [], 'type': bool}},
+                                  {'mode': {'required': False, 'keys': [], 'type': str}},
+                                  {'interval': {'required': False, 'keys': [], 'type': float}},
+                              ]}},
+                              {'backfill': {'required': False, 'keys': [
+                                  {'enable': {'required': True, 'keys': [], 'type': bool}},
+                                  {'start': {'required': True, 'keys': [], 'type': str}},
+                                  {'stop': {'required': False, 'keys': [], 'type': str}},
+                                  {'outputs': {'required': False, 'keys': [], 'type': list}},
+                              ]}},
+                              {'retry': {'required': False, 'keys': [
+                                  {'attempts': {'required': False, 'keys': [], 'type': int}},
+                                  {'timeout': {'required': False, 'keys': [], 'type': float}},
+                                  {'backoff': {'required': False, 'keys': [], 'type': float}},
+                                  {'backoff_max': {'required': False, 'keys': [], 'type': float}},
+                                  {'jitter': {'required': False, 'keys': [], 'type': float}},
+                                  {'breaker_threshold': {'required': False, 'keys': [], 'type': int}},
+                                  {'breaker_reset': {'required': False, 'keys': [], 'type': float}},
+                              ]}},
+                              {'cache': {'required': False, 'keys': [
+                                  {'enable': {'required': False, 'keys': [], 'type': bool}},
+                                  {'path': {'required': False, 'keys': [], 'type': str}},
+                                  {'ttl': {'required': False, 'keys': [], 'type': int}},
+                                  {'compression': {'required': False, 'keys': [], 'type': str}},
+                              ]}},
+                              {'traffic': {'required': False, 'keys': [
+                                  {'mode': {'required': True, 'keys': [], 'type': str}},
+                                  {'file': {'required': False, 'keys': [], 'type': str}},
+                                  {'timing': {'required': False, 'keys': [], 'type': str}},
+                              ]}},
+                              {'checkpoints': {'required': False, 'keys': [
+                                  {'enable': {'required': False, 'keys': [], 'type': bool}},
+                                  {'file': {'required': False, 'keys': [], 'type': str}},
+                                  {'reconcile': {'required': False, 'keys': [], 'type': bool}},
+                              ]}},
 
                           ],
                           },
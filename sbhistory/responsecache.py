@@ -0,0 +1,108 @@
+"""Keep the raw getLogger results on disk so they are only requested from the inverters once."""
+
+import gzip
+import hashlib
+import logging
+import lzma
+import os
+import time
+
+from loggerparser import LoggerParser, write_records
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+_DEFAULT_CACHE_DIRECTORY = 'sbhistory_cache'
+
+# Seconds an entry for a window that is still being logged (ends after now) stays valid
+DEFAULT_TTL = 300
+
+# Bytes decompressed at a time when reading an entry
+READ_SIZE = 65536
+
+# A window ending less than this many seconds ago may still get late records
+SETTLE_SECONDS = 3600
+
+COMPRESSION = {
+    'gzip': {'open': gzip.open, 'suffix': '.json.gz'},
+    'lzma': {'open': lzma.open, 'suffix': '.json.xz'},
+}
+
+
+class ResponseCache:
+    """Class to cache getLogger results per (inverter, key, tStart, tEnd).
+
+    Each result is stored compressed in a file named after a hash of the request,
+    results for windows that closed in the past never expire, results for the
+    window that includes now expire after 'ttl' seconds.
+    """
+
+    def __init__(self, directory=None, ttl=DEFAULT_TTL, compression='gzip'):
+        """Create a new ResponseCache object."""
+        self._directory = os.path.abspath(os.path.expanduser(directory or _DEFAULT_CACHE_DIRECTORY))
+        self._ttl = ttl
+        if compression not in COMPRESSION:
+            _LOGGER.warning(f"Unknown cache compression '{compression}', using 'gzip'")
+            compression = 'gzip'
+        self._compression = COMPRESSION[compression]
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._stored = 0
+        self._bytes = 0
+        os.makedirs(self._directory, exist_ok=True)
+
+    def filename(self, url, key, start, end):
+        """Cache file for a request, named after the SHA-1 of the request fields."""
+        digest = hashlib.sha1(f"{url}|{key}|{start}|{end}".encode()).hexdigest()
+        return os.path.join(self._directory, digest[:2], digest + self._compression['suffix'])
+
+    def closed(self, end):
+        """True if no more records can be logged in a window ending at 'end'."""
+        return end < time.time() - SETTLE_SECONDS
+
+    def get(self, url, key, start, end):
+        """Return the cached result of a request as a Series or None."""
+        filename = self.filename(url, key, start, end)
+        try:
+            if not self.closed(end) and time.time() - os.path.getmtime(filename) > self._ttl:
+                self._expired += 1
+                self._misses += 1
+                return None
+            parser = LoggerParser(envelope=False)
+            with self._compression['open'](filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                    parser.feed(chunk)
+            result = parser.finish()
+        except FileNotFoundError:
+            self._misses += 1
+            return None
+        except Exception as e:
+            _LOGGER.warning(f"Ignoring unreadable cache entry {filename}: {e}")
+            self._misses += 1
+            return None
+        self._hits += 1
+        return result
+
+    def put(self, url, key, start, end, series):
+        """Save the result of a request (a Series)."""
+        filename = self.filename(url, key, start, end)
+        temporary = filename + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with self._compression['open'](temporary, 'wt') as f:
+                write_records(f, series)
+            os.replace(temporary, filename)
+            self._stored += 1
+            self._bytes += os.path.getsize(filename)
+        except Exception as e:
+            _LOGGER.error(f"Unable to save cache entry {filename}: {e}")
+
+    def report(self):
+        """Log the cache statistics for the run."""
+        if not self._hits and not self._misses:
+            return
+        _LOGGER.info(
+            f"Response cache: {self._hits} hits, {self._misses} misses ({self._expired} expired), "
+            f"{self._stored} stored ({self._bytes / 1024:.0f} KiB compressed)"
+        )
@@ -0,0 +1,133 @@
+"""Retry policy and circuit breakers for the inverter requests."""
+
+import logging
+import random
+import time
+
+import fastjson
+import metrics
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+
+class CircuitBreaker:
+    """Class to stop sending requests to an inverter that keeps failing.
+
+    After 'threshold' consecutive failed requests the breaker opens and
+    requests fail at once, after 'reset' seconds one trial request is let
+    through (half open) and its result closes or reopens the breaker. The
+    other requests are held back while the trial request is outstanding, a
+    trial that never reports back is replaced after another 'reset' seconds.
+    'trials' counts the failed trial requests so a caller that waited for one
+    knows when to give up.
+    """
+
+    def __init__(self, threshold=5, reset=30.0):
+        """Create a new CircuitBreaker object, closed."""
+        self._threshold = threshold
+        self._reset = reset
+        self._failures = 0
+        self._opened = None
+        self._probe = None
+        self.trips = 0
+        self.trials = 0
+
+    @property
+    def state(self):
+        if self._opened is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self._opened >= self._reset else 'open'
+
+    def allow(self):
+        """True if a request may be sent, in the half open state only for the trial request."""
+        state = self.state
+        if state != 'half-open':
+            return state == 'closed'
+        now = time.monotonic()
+        if self._probe is not None and now - self._probe < self._reset:
+            return False
+        self._probe = now
+        return True
+
+    def wait(self):
+        """Seconds until allow() may let a request through, 0 when it can be asked now."""
+        if self._opened is None:
+            return 0.0
+        now = time.monotonic()
+        if self._probe is not None and now - self._probe < self._reset:
+            # Until the outstanding trial request reports back, or is given up on
+            return self._probe + self._reset - now
+        return max(0.0, self._opened + self._reset - now)
+
+    def success(self):
+        self._failures = 0
+        self._opened = None
+        self._probe = None
+
+    def failure(self):
+        if self._probe is not None:
+            self.trials += 1
+        self._probe = None
+        self._failures += 1
+        if self._opened is not None or self._failures >= self._threshold:
+            if self._opened is None:
+                self.trips += 1
+            self._opened = time.monotonic()
+
+
+class RetryPolicy:
+    """Class to describe how requests are retried, shared by all the inverters of a site.
+
+    Each attempt has its own timeout, retries wait backoff * 2^(n-1) seconds
+    (capped at backoff_max) less a random fraction of up to 'jitter' so the
+    inverters aren't hit in lockstep. A circuit breaker is kept per inverter,
+    the request telemetry is collected by the metrics module.
+    """
+
+    def __init__(self, attempts=3, timeout=3.0, backoff=0.5, backoff_max=10.0, jitter=0.5,
+                 breaker_threshold=5, breaker_reset=30.0):
+        """Create a new RetryPolicy object."""
+        self.attempts = max(1, attempts)
+        self.timeout = timeout
+        self._backoff = backoff
+        self._backoff_max = backoff_max
+        self._jitter = jitter
+        self._breaker_threshold = breaker_threshold
+        self._breaker_reset = breaker_reset
+        self._breakers = {}
+
+    def delay(self, attempt):
+        """Seconds to wait before retry number 'attempt' (1 for the first retry)."""
+        delay = min(self._backoff_max, self._backoff * 2 ** (attempt - 1))
+        return delay * (1 - self._jitter * random.random())
+
+    def breaker(self, name):
+        if name not in self._breakers:
+            self._breakers[name] = CircuitBreaker(self._breaker_threshold, self._breaker_reset)
+        return self._breakers[name]
+
+    def report(self):
+        """Log the request telemetry of each inverter from the sma_* metrics."""
+        for name in metrics.registry.values('sma_requests_total', 'inverter'):
+            requests = metrics.total('sma_requests_total', inverter=name)
+            latency = metrics.combined('sma_request_seconds', inverter=name)
+            decode = metrics.combined('sma_decode_seconds', inverter=name)
+            size = metrics.total('sma_response_bytes_total', inverter=name)
+            average = latency.total / latency.count if latency.count else 0.0
+            trips = self._breakers[name].trips if name in self._breakers else 0
+            _LOGGER.info(
+                f"Requests to {name}: {requests} requests, {metrics.total('sma_attempts_total', inverter=name)} "
+                f"attempts, {metrics.total('sma_timeouts_total', inverter=name)} timeouts, "
+                f"{metrics.total('sma_errors_total', inverter=name)} errors, "
+                f"{metrics.total('sma_failures_total', inverter=name)} failed, "
+                f"{metrics.total('sma_rejected_total', inverter=name)} rejected by the breaker "
+                f"({trips} trips), {average * 1000:.0f} ms average"
+            )
+            if latency.count:
+                _LOGGER.info(f"Latency {name}: {latency.summary()}")
+                _LOGGER.info(
+                    f"Decoding {name}: {size / 1024:.0f} KiB with {fastjson.BACKEND}, "
+                    f"{decode.total / latency.count * 1000:.2f} ms average, "
+                    f"{size / max(decode.total, 1e-9) / 1e6:.0f} MB/s"
+                )
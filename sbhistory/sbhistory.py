@@ -2,6 +2,7 @@
 # Robust initialization and shutdown code courtesy of
 # https://github.com/wbenny/python-graceful-shutdown.git
 
+import argparse
 import logging
 import sys
 import os
@@ -13,6 +14,7 @@ from delayedints import DelayedKeyboardInterrupt
 from pvsite import Site
 import version
 import logfiles
+import profiling
 from readconfig import read_config
 
 from exceptions import FailedInitialization
@@ -84,18 +86,28 @@ class SBHistory:
 def main():
     """Set up and start sbhistory."""
 
+    parser = argparse.ArgumentParser(description='Download SMA Sunny Boy WebConnect history to InfluxDB')
+    parser.add_argument(
+        '--profile', nargs='?', const='auto', choices=['auto', 'sampling', 'cprofile'],
+        help='profile the run and trace its memory, the reports are written next to the log file',
+    )
+    args = parser.parse_args()
+
     try:
         config = read_config(checking=False)
     except FailedInitialization as e:
         print(f"{e}")
         return
 
-    logfiles.start(config)
+    log_file = logfiles.start(config)
     _LOGGER.info(f"sbhistory inverter utility {version.get_version()}, PID is {os.getpid()}")
 
     try:
         sbhistory = SBHistory(read_config(checking=True))
-        sbhistory.run()
+        if args.profile:
+            profiling.Profiler(os.path.dirname(log_file), args.profile).run(sbhistory.run)
+        else:
+            sbhistory.run()
     except FailedInitialization as e:
         _LOGGER.error(f"{e}")
     except Exception as e:
@@ -0,0 +1,75 @@
+"""Run the independent sbhistory stages concurrently."""
+
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import profiling
+import progress
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+
+class Scheduler:
+    """Class to run a group of stages concurrently and report the wall time of each.
+
+    CPU/disk bound stages are plain functions run in a thread pool so they do not
+    stall the event loop, inverter stages are coroutines run on the event loop.
+    """
+
+    def __init__(self, workers=None):
+        """Create a new Scheduler object."""
+        self._workers = workers
+        self._stages = []
+        self._timings = {}
+
+    def add_cpu_stage(self, name, function, *args):
+        """Add a blocking stage to be run in the executor."""
+        self._stages.append((name, function, args, True))
+
+    def add_stage(self, name, coroutine_function, *args):
+        """Add a coroutine stage to be run on the event loop."""
+        self._stages.append((name, coroutine_function, args, False))
+
+    @property
+    def timings(self):
+        """Wall time in seconds of each stage that has been run."""
+        return dict(self._timings)
+
+    async def _run_stage(self, executor, name, function, args, cpu):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            with progress.stage(name):
+                if cpu:
+                    # The executor thread runs the stage with this task's context so it reports its progress
+                    context = contextvars.copy_context()
+                    await loop.run_in_executor(executor, context.run, profiling.threaded(name, function), *args)
+                else:
+                    await function(*args)
+        except Exception as e:
+            _LOGGER.error(f"Stage '{name}' failed: {e}")
+        finally:
+            elapsed = time.perf_counter() - start
+            self._timings[name] = elapsed
+            metrics.observe('stage_seconds', elapsed, stage=name)
+            _LOGGER.debug(f"Stage '{name}' completed in {elapsed:.1f} seconds")
+
+    async def run(self):
+        """Run all the stages added since the last run and wait for them to complete."""
+        stages, self._stages = self._stages, []
+        if not stages:
+            return
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='sbhistory') as executor:
+            await asyncio.gather(
+                *(self._run_stage(executor, name, function, args, cpu) for name, function, args, cpu in stages)
+            )
+
+    def report(self):
+        """Log the wall time of each stage."""
+        for name, elapsed in self._timings.items():
+            _LOGGER.info(f"Stage '{name}' wall time: {elapsed:.1f} seconds")
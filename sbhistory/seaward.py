@@ -2,80 +2,367 @@
 
 import logging
 import os
+import io
 import csv
+import hashlib
 import datetime
+import threading
+
+import processpool
+import progress
+import statefile
 
 
 _LOGGER = logging.getLogger('sbhistory')
 
+_DEFAULT_MANIFEST_FILE = 'sbhistory_seaward_manifest.json'
+
+# Points handed to the database writer at a time, files are only recorded in the manifest once written
+BATCH_SIZE = 5000
+
+
+class Manifest:
+    """Class to remember the Seaward files already imported, keyed by path with their size, mtime, and content hash.
+
+    A file whose size and mtime are unchanged is skipped without being read, a
+    file that was only touched is recognized by its hash. The manifest is kept
+    in a JSON file that is rewritten whenever the database writer reports a
+    group of files as written.
+    """
+
+    def __init__(self, filename=None, enabled=True):
+        """Create a new Manifest object and load any saved state."""
+        self._filename = statefile.path(filename, _DEFAULT_MANIFEST_FILE)
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._files = {}
+        if enabled:
+            self._files = statefile.load(self._filename, 'the Seaward manifest')
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def unchanged(self, path, stat):
+        """True if the file has been imported and its size and mtime haven't changed since."""
+        if not self._enabled:
+            return False
+        with self._lock:
+            entry = self._files.get(path)
+        return entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
+
+    def digest(self, path):
+        """Content hash recorded for an imported file or None."""
+        with self._lock:
+            entry = self._files.get(path)
+        return entry['sha256'] if entry else None
+
+    def record(self, files):
+        """Record a list of (path, stat, digest) as imported."""
+        if not self._enabled or not files:
+            return
+        with self._lock:
+            for path, stat, digest in files:
+                self._files[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest}
+            self._save()
+
+    def _save(self):
+        statefile.save(self._filename, self._files, 'the Seaward manifest')
+
+
+HEADINGS = ['Date', 'Time', 'Tpv', 'Ta', 'Irr', 'Irr Unit', 'Temp Unit']
+
+
+def local_timestamp(d, seconds, tzinfo):
+    """Epoch time of 'seconds' after midnight on local date d."""
+    t = datetime.time(hour=seconds // 3600, minute=seconds // 60 % 60)
+    return int(datetime.datetime.combine(date=d, time=t, tzinfo=tzinfo).timestamp())
+
+
+def _date(date):
+    day, month, year = date.split(b'.')
+    return datetime.date(year=int(b'20' + year), month=int(month), day=int(day))
+
+
+def _midnights(dates, tzinfo):
+    """Epoch time of local midnight for each 'dd.mm.yy' date, None for the dates where the UTC offset changes."""
+    days = {_date(date): date for date in dates}
+    epochs = {}
+    midnights = {}
+    for d in sorted(days):
+        following = d + datetime.timedelta(days=1)
+        midnight = epochs.pop(d, None)
+        if midnight is None:
+            midnight = local_timestamp(d, 0, tzinfo)
+        epochs[following] = local_timestamp(following, 0, tzinfo)
+        midnights[days[d]] = midnight if epochs[following] - midnight == 86400 else None
+    return midnights
+
+
+def _seconds(time):
+    hms = time.split(b':')
+    return int(hms[0]) * 3600 + int(hms[1]) * 60
+
+
+def _measured(irradiance):
+    irradiance = float(b'0' if irradiance.startswith(b'<') else irradiance)
+    return f"sun,_type=measured irradiance={irradiance} "
+
+
+def _valid(temperature):
+    return temperature and temperature != b'ERR'
+
+
+def _columns(content, headings):
+    """Return the columns of a plain CSV file up to the first empty line, a list of values per heading.
+
+    Returns None for files the csv module has to handle (quoted fields, mixed
+    line ends, rows of different lengths).
+    """
+    newline = b'\r\n' if b'\r\n' in content else b'\n'
+    # No quote character, and either no '\r' at all or one before every '\n'
+    if b'|' in content or content.count(b'\r') != (newline == b'\r\n') * content.count(b'\n'):
+        return None
+    end = content.find(newline + newline)
+    if end >= 0:
+        content = content[:end]
+    lines = [] if content.startswith(newline) else content.split(newline)
+    if lines and not lines[-1]:
+        lines.pop()
+    if not lines:
+        return {}
+    heading = lines[0].decode().split(',')
+    index = {h: heading.index(h) for h in headings}
+    width = len(heading)
+    body = lines[1:]
+    if any(line.count(b',') != width - 1 for line in body):
+        return None
+    # Every row has 'width' fields, so once the rows are joined and split again
+    # field i of every row is at i, i + width, i + 2 * width, ... of the one list
+    fields = b','.join(body).split(b',') if body else []
+    return {h: fields[i::width] for h, i in index.items()}
+
 
-def process(directory, tzinfo, influxdb):
+def parse(content, tzinfo):
+    """Return the line protocol points of the contents (bytes) of a Seaward CSV file.
+
+    The file is split into columns and each distinct date, time, and value is
+    converted once, the timestamps are the cached local midnight of the date
+    plus the time of day (days with a UTC offset change are converted row by
+    row). The points are the same, in the same order, as parse_rows() which
+    handles the files that aren't plain ASCII CSV and finds the line at fault
+    in a file that can't be parsed.
+    """
+    if content.isascii():
+        try:
+            columns = _columns(content, HEADINGS)
+            if columns is not None:
+                return _parse_columns(columns, tzinfo)
+        except Exception:
+            pass
+    return parse_rows(io.StringIO(content.decode(), newline=''), tzinfo)
+
+
+def _parse_columns(columns, tzinfo):
+    if not columns:
+        return []
+    dates, times, irradiances, tpvs, tas = (columns[h] for h in ['Date', 'Time', 'Irr', 'Tpv', 'Ta'])
+
+    # Each distinct date, time, and value is converted once, the point prefixes end with a space
+    midnights = _midnights(set(dates), tzinfo)
+    seconds = {time: _seconds(time) for time in set(times)}
+    measured = {value: _measured(value) for value in set(irradiances)}
+    # Like parse_rows() the working temperature is written from Ta and the ambient from Tpv
+    working = {ta: f"sun,_type=working temperature={float(ta)} " for ta in set(tas) if _valid(ta)}
+    ambient = {tpv: f"sun,_type=ambient temperature={float(tpv)} " for tpv in set(tpvs) if _valid(tpv)}
+
+    lp_points = []
+    append = lp_points.append
+    for date, time, irradiance, tpv, ta in zip(dates, times, irradiances, tpvs, tas):
+        midnight = midnights[date]
+        if midnight is None:
+            stamp = str(local_timestamp(_date(date), seconds[time], tzinfo))
+        else:
+            stamp = str(midnight + seconds[time])
+        append(measured[irradiance] + stamp)
+        # parse_rows() fails on a row with only one of the temperatures
+        if (tpv in ambient) != (ta in working):
+            raise ValueError('A row has only one valid temperature')
+        if tpv in ambient:
+            append(working[ta] + stamp)
+            append(ambient[tpv] + stamp)
+    return lp_points
+
+
+def parse_rows(csvfile, tzinfo):
+    """Return the line protocol points of an open Seaward CSV file, one row at a time.
+
+    Used to find the line at fault when parse() fails.
+    """
+    csv_indices = {}
+    lp_points = []
+    reader = csv.reader(csvfile, delimiter=',', quotechar='|')
     try:
-        _LOGGER.info(f"Processing files from {directory}")
-        for entry in os.scandir(directory):
-            if not entry.is_file():
+        for row in reader:
+            if len(row) == 0:
+                break
+            if reader.line_num == 1:
+                to_find = ['Date', 'Time', 'Tpv', 'Ta', 'Irr', 'Irr Unit', 'Temp Unit']
+                for heading in to_find:
+                    index = row.index(heading)
+                    csv_indices[heading] = index
+            else:
+                irradiance = row[csv_indices['Irr']]
+                if irradiance.startswith('<'):
+                    irradiance = '0'
+                irradiance = float(irradiance)
+
+                date = row[csv_indices['Date']]
+                date_dmy = date.split('.')
+                d = datetime.date(
+                    year=int('20' + date_dmy[2]), month=int(date_dmy[1]), day=int(date_dmy[0])
+                )
+
+                time = row[csv_indices['Time']]
+                time_hms = time.split(':')
+                t = datetime.time(hour=int(time_hms[0]), minute=int(time_hms[1]))
+                dt = datetime.datetime.combine(date=d, time=t, tzinfo=tzinfo)
+                ts = int(dt.timestamp())
+
+                tpv = row[csv_indices['Tpv']]
+                if tpv == 'ERR':
+                    tpv = None
+                ta = row[csv_indices['Ta']]
+                if ta == 'ERR':
+                    ta = None
+
+                # sample: sun,_type=measured irradiance=800 1556813561098
+                lp_points.append(f"sun,_type=measured irradiance={irradiance} {ts}")
+                if tpv:
+                    # sample: sun,_type=working temperature=10 1556813561098
+                    lp_points.append(f"sun,_type=working temperature={float(ta)} {ts}")
+                if ta:
+                    # sample: sun,_type=ambient temperature=8 1556813561098
+                    lp_points.append(f"sun,_type=ambient temperature={float(tpv)} {ts}")
+    except Exception as e:
+        raise ValueError(f"line {reader.line_num}: {e}")
+    return lp_points
+
+
+def parse_file(path, tzinfo, known=None):
+    """Return (content hash, points) for a Seaward CSV file, points is None if the hash matches 'known'."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    if digest == known:
+        return digest, None
+    return digest, parse(content, tzinfo)
+
+
+def scan(directory, manifest=None):
+    """Return the (path, stat) of the CSV files in a directory that aren't in the manifest, and the count skipped."""
+    files = []
+    skipped = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.path.endswith('.csv'):
                 continue
-            if not entry.path.endswith('.csv'):
+            path = os.path.abspath(entry.path)
+            stat = entry.stat()
+            if manifest and manifest.unchanged(path, stat):
+                skipped += 1
                 continue
+            files.append((path, stat))
+    files.sort()
+    return files, skipped
+
+
+def parsed_files(files, tzinfo, manifest=None, workers=None):
+    """Generator yielding (path, stat, digest, points or None, error or None) in file order.
+
+    With more than one worker the files are parsed in a process pool.
+    """
+    workers = processpool.workers(workers)
+    tasks = (
+        ((path, stat), (path, tzinfo, manifest.digest(path) if manifest else None)) for path, stat in files
+    )
+    if workers == 1 or len(files) < 2:
+        for (path, stat), args in tasks:
+            try:
+                yield (path, stat) + parse_file(*args) + (None,)
+            except Exception as e:
+                yield path, stat, None, None, e
+        return
+
+    with processpool.pool(workers) as executor:
+        for (path, stat), future in processpool.ordered(executor, workers, parse_file, tasks):
+            try:
+                yield (path, stat) + future.result() + (None,)
+            except Exception as e:
+                yield path, stat, None, None, e
+
 
-            csv_indices = {}
-            lp_points = []
-            with open(entry.path, newline='') as csvfile:
-                _LOGGER.info(f"Processing file {entry.name}")
-                reader = csv.reader(csvfile, delimiter=',', quotechar='|')
-                for row in reader:
-                    if len(row) == 0:
-                        break
-                    if reader.line_num == 1:
-                        to_find = ['Date', 'Time', 'Tpv', 'Ta', 'Irr', 'Irr Unit', 'Temp Unit']
-                        for heading in to_find:
-                            index = row.index(heading)
-                            csv_indices[heading] = index
-                    else:
-                        irradiance = row[csv_indices['Irr']]
-                        if irradiance.startswith('<'):
-                            irradiance = '0'
-                        irradiance = float(irradiance)
-
-                        date = row[csv_indices['Date']]
-                        date_dmy = date.split('.')
-                        d = datetime.date(
-                            year=int('20' + date_dmy[2]), month=int(date_dmy[1]), day=int(date_dmy[0])
-                        )
-
-                        time = row[csv_indices['Time']]
-                        time_hms = time.split(':')
-                        t = datetime.time(hour=int(time_hms[0]), minute=int(time_hms[1]))
-                        dt = datetime.datetime.combine(date=d, time=t, tzinfo=tzinfo)
-                        ts = int(dt.timestamp())
-
-                        tpv = row[csv_indices['Tpv']]
-                        if tpv == 'ERR':
-                            tpv = None
-                        ta = row[csv_indices['Ta']]
-                        if ta == 'ERR':
-                            ta = None
-
-                        # sample: sun,_type=measured irradiance=800 1556813561098
-                        lp_points.append(f"sun,_type=measured irradiance={irradiance} {ts}")
-                        if tpv:
-                            # sample: sun,_type=working temperature=10 1556813561098
-                            lp_points.append(f"sun,_type=working temperature={float(ta)} {ts}")
-                        if ta:
-                            # sample: sun,_type=ambient temperature=8 1556813561098
-                            lp_points.append(f"sun,_type=ambient temperature={float(tpv)} {ts}")
-                        print('.', end='', flush=True)
-
-                print()
-                influxdb.write_points(lp_points)
+def process(directory, tzinfo, influxdb, manifest=None, workers=None):
+    """Import the new and changed Seaward CSV files of a directory.
 
+    Points from consecutive files are written in batches of about BATCH_SIZE,
+    the files of a batch are added to the manifest once the batch is written.
+    """
+    try:
+        _LOGGER.info(f"Processing files from {directory}")
+        files, skipped = scan(directory, manifest)
     except FileNotFoundError as e:
         _LOGGER.error(f"{e}")
         return None
 
-    except Exception as e:
-        print()
-        _LOGGER.error(f"An error occurred in {entry.name}, line {reader.line_num}: {e}")
-        return None
+    if skipped:
+        _LOGGER.info(f"Skipping {skipped} Seaward file(s) already imported")
+    progress.total(len(files), 'files')
+    queued = 0
+    unreadable = 0
+    batch = []
+    batch_files = []
+    for path, stat, digest, points, error in parsed_files(files, tzinfo, manifest, workers):
+        progress.advance()
+        name = os.path.basename(path)
+        if error:
+            _LOGGER.error(f"An error occurred in {name}, {error}")
+            unreadable += 1
+            continue
+        if points is None:
+            _LOGGER.debug(f"File {name} is unchanged")
+            manifest.record([(path, stat, digest)])
+            continue
+        _LOGGER.debug(f"Processing file {name}")
+        batch.extend(points)
+        batch_files.append((path, stat, digest))
+        if len(batch) >= BATCH_SIZE:
+            queued += write_batch(influxdb, batch, batch_files, manifest)
+            batch = []
+            batch_files = []
+    if batch_files:
+        queued += write_batch(influxdb, batch, batch_files, manifest)
+    _LOGGER.info(f"Queued {queued} Seaward file(s) for import, {unreadable} could not be read")
+
+
+def write_batch(influxdb, batch, files, manifest=None):
+    """Hand the points of a group of files to the database writer, returns the number of files queued.
+
+    The files are recorded in the manifest once the writer reports their points as written.
+    """
+    def on_written(ok):
+        if ok:
+            if manifest:
+                manifest.record(files)
+        else:
+            _LOGGER.error(f"The points of {len(files)} Seaward file(s) were not written, they are imported next run")
 
-    print()
+    if not batch:
+        # Nothing to write, the files are only recorded when a database is being written
+        if manifest and influxdb.enabled:
+            manifest.record(files)
+        return len(files)
+    if not influxdb.write_points(batch, on_written):
+        _LOGGER.error(f"Failed to write the points of {len(files)} Seaward file(s)")
+        return 0
+    return len(files)
@@ -0,0 +1,92 @@
+"""Compact columnar storage for inverter history."""
+
+from array import array
+
+import numpy as np
+
+
+class Series:
+    """Class to hold the history of one inverter.
+
+    The timestamps and values are kept in array buffers (8 bytes each) with a
+    validity mask (1 byte) in place of a list of {'t': ..., 'v': ...} dicts,
+    samples the inverter reported as null are stored as invalid.
+    """
+
+    __slots__ = ('name', 't', 'v', 'valid')
+
+    def __init__(self, name, t=None, v=None, valid=None):
+        """Create a new Series object."""
+        self.name = name
+        self.t = array('q', t if t is not None else [])
+        self.v = array('q', v if v is not None else [])
+        self.valid = bytearray(valid if valid is not None else b'\x01' * len(self.t))
+
+    @classmethod
+    def from_records(cls, name, records):
+        """Create a Series from a getLogger result, a list of {'t': ..., 'v': ...} dicts."""
+        series = cls(name)
+        for record in records:
+            series.append(record['t'], record['v'])
+        return series
+
+    @classmethod
+    def from_arrays(cls, name, t, v, valid):
+        """Create a Series from NumPy arrays."""
+        series = cls(name)
+        series.t.frombytes(np.ascontiguousarray(t, dtype=np.int64).tobytes())
+        series.v.frombytes(np.ascontiguousarray(v, dtype=np.int64).tobytes())
+        series.valid = bytearray(np.ascontiguousarray(valid, dtype=np.uint8).tobytes())
+        return series
+
+    def __len__(self):
+        return len(self.t)
+
+    def __iter__(self):
+        """Iterate over (t, v) pairs, v is None for missing samples."""
+        for t, v, valid in zip(self.t, self.v, self.valid):
+            yield t, v if valid else None
+
+    def __getitem__(self, index):
+        return self.t[index], self.v[index] if self.valid[index] else None
+
+    def __repr__(self):
+        return f"Series({self.name!r}, {len(self)} samples)"
+
+    def append(self, t, v):
+        """Add a sample, v is None for a missing value."""
+        self.t.append(t)
+        self.v.append(v if v is not None else 0)
+        self.valid.append(v is not None)
+
+    def extend(self, other):
+        """Add the samples from another Series."""
+        self.t.extend(other.t)
+        self.v.extend(other.v)
+        self.valid.extend(other.valid)
+
+    def copy(self, name=None):
+        """Return a copy, optionally with a new name."""
+        return Series(self.name if name is None else name, self.t, self.v, self.valid)
+
+    def arrays(self):
+        """Return (t, v, valid) NumPy views of the buffers (no copy).
+
+        The buffers can't be resized while a view exists, drop the views before appending.
+        """
+        t = np.frombuffer(self.t, dtype=np.int64) if len(self.t) else np.zeros(0, dtype=np.int64)
+        v = np.frombuffer(self.v, dtype=np.int64) if len(self.v) else np.zeros(0, dtype=np.int64)
+        valid = np.frombuffer(self.valid, dtype=np.bool_) if len(self.valid) else np.zeros(0, dtype=np.bool_)
+        return t, v, valid
+
+    def sort(self):
+        """Sort the samples by timestamp (stable)."""
+        t, v, valid = self.arrays()
+        order = np.argsort(t, kind='stable')
+        ordered = Series.from_arrays(self.name, t[order], v[order], valid[order])
+        del t, v, valid
+        self.t, self.v, self.valid = ordered.t, ordered.v, ordered.valid
+
+    def nbytes(self):
+        """Memory used by the sample buffers."""
+        return len(self.t) * (self.t.itemsize + self.v.itemsize + 1)
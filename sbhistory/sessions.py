@@ -0,0 +1,58 @@
+"""Keep inverter sessions alive for the duration of a run."""
+
+import asyncio
+import logging
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+
+class SessionManager:
+    """Class to manage the login sessions for a group of inverters.
+
+    The inverters are logged in on the first request and stay logged in until
+    close() is called, a session dropped by the inverter (an 'err' reply) is
+    reopened by the SMA class on the next read. With 'lazy' the login is left
+    to the first request that has to go to the inverter.
+    """
+
+    def __init__(self, inverters, lazy=False):
+        """Create a new SessionManager object."""
+        self._inverters = inverters
+        self._lazy = lazy
+        self._requests = 0
+        self._avoided = 0
+        self._lock = asyncio.Lock()
+
+    async def open(self):
+        """Make sure every inverter has a session, only logging in when needed."""
+        async with self._lock:
+            self._requests += len(self._inverters)
+            if self._lazy:
+                pending = [inverter for inverter in self._inverters if not inverter.ready]
+            else:
+                pending = [inverter for inverter in self._inverters if not inverter.connected]
+            self._avoided += len(self._inverters) - len(pending)
+            if not pending:
+                return True
+
+            results = await asyncio.gather(*(inverter.initialize(login=not self._lazy) for inverter in pending))
+            success = True
+            for result in results:
+                error = result.get('error', None)
+                if error is None or len(error) > 0:
+                    _LOGGER.error(f"Connection to inverter '{result.get('name')}' failed: {result.get('error', 'None')}")
+                    success = False
+            return success
+
+    async def close(self):
+        """Log out of all the inverters."""
+        async with self._lock:
+            await asyncio.gather(*(inverter.close() for inverter in self._inverters))
+
+    def report(self):
+        """Log the session statistics for the run."""
+        if not self._requests:
+            return
+        logins = sum(inverter.logins for inverter in self._inverters)
+        _LOGGER.info(f"Inverter sessions: {self._requests} requested, {logins} logins, {self._avoided} logins avoided")
@@ -6,12 +6,18 @@ Based on: http://www.github.com/kellerza/pysma
 import asyncio
 import json
 import logging
+import time
 
 import async_timeout
 import jmespath
 from aiohttp import client_exceptions
 
+import fastjson
+import metrics
 from exceptions import SmaException
+from loggerparser import FormatError, IncompleteError, LoggerParser
+from series import Series
+from retry import RetryPolicy
 
 
 _LOGGER = logging.getLogger('sbhistory')
@@ -28,12 +34,23 @@ URL_VALUES = '/dyn/getValues.json'
 URL_LOGGER = '/dyn/getLogger.json'
 URL_ONLINE = '/dyn/getAllOnlValues.json'
 
+# getLogger keys
+KEY_DAILY_HISTORY = 28704
+KEY_FINE_HISTORY = 28672
+
+# Bytes handed to the getLogger parser at a time
+STREAM_CHUNK = 65536
+
+# Longest sleep between two looks at an open circuit breaker
+BREAKER_POLL = 1.0
+
 
 class SMA:
     """Class to connect to the SMA webconnect module and read parameters."""
 
-    def __init__(self, session, url, password, group='user', uid=None):
-        """Init SMA connection."""
+    def __init__(self, session, url, password, group='user', uid=None, cache=None, traffic=None, retry=None,
+                 name=None):
+        """Init SMA connection, 'name' labels the metrics and defaults to the url."""
         if group not in USERS:
             _LOGGER.debug(f"Invalid user type: {group}")
             raise SmaException(SmaException.BAD_USER_TYPE)
@@ -49,46 +66,130 @@ class SMA:
         self._url = url.rstrip('/')
         if not url.startswith('http'):
             self._url = 'http://' + self._url
+        self._name = name or self._url
         self._aio_session = session
         self.sma_sid = None
         self.sma_uid = uid
+        self.logins = 0
+        self._cache = cache
+        self._traffic = traffic
+        self._retry = retry or RetryPolicy()
+        # Recorded traffic holds decoded replies so it can't use the streaming parser
+        self._stream = traffic is None
+
+    async def _fetch_json(self, url, payload, parser=None):
+        """Fetch json data for requests, through the traffic recorder or player if there is one.
 
-    async def _fetch_json(self, url, payload):
-        """Fetch json data for requests."""
+        'parser' optionally creates a LoggerParser that decodes the reply as it is received.
+        """
+        if self._traffic:
+            return await self._traffic.exchange(self._url, url, payload, lambda: self._post_json(url, payload))
+        return await self._post_json(url, payload, parser if self._stream else None)
+
+    async def _post_json(self, url, payload, parser=None):
         params = {
             'data': json.dumps(payload),
             'headers': {'content-type': 'application/json'},
             'params': {'sid': self.sma_sid} if self.sma_sid else None,
         }
-        for _ in range(3):
+        policy = self._retry
+        breaker = policy.breaker(self._name)
+        labels = {'inverter': self._name, 'endpoint': url.rsplit('/', 1)[-1].split('.')[0]}
+        metrics.count('sma_requests_total', **labels)
+        if not breaker.allow():
+            # An open breaker pauses the requests until its trial request, they only fail along
+            # with that trial, a logout isn't worth waiting for
+            trials = breaker.trials
+            _LOGGER.debug(f"{self._name}: circuit breaker open, waiting {breaker.wait():.0f} seconds")
+            while not breaker.allow():
+                if breaker.trials != trials or url == URL_LOGOUT:
+                    metrics.count('sma_rejected_total', **labels)
+                    return {'err': f"Not connecting to SMA at {self._url} (circuit breaker open)"}
+                await asyncio.sleep(min(breaker.wait(), BREAKER_POLL))
+
+        for attempt in range(policy.attempts):
+            if attempt:
+                await asyncio.sleep(policy.delay(attempt))
+            metrics.count('sma_attempts_total', **labels)
+            start = time.perf_counter()
             try:
-                with async_timeout.timeout(3):
+                async with async_timeout.timeout(policy.timeout):
                     res = await self._aio_session.post(self._url + url, **params)
-                    return (await res.json()) or {}
-            except (asyncio.TimeoutError, client_exceptions.ClientError):
-                continue
+                    if parser:
+                        body, size, decode = await self._stream_body(res, parser())
+                    else:
+                        raw = await res.read()
+                        size = len(raw)
+                if not parser:
+                    decoded = time.perf_counter()
+                    body = fastjson.loads(raw) or {}
+                    decode = time.perf_counter() - decoded
+                elapsed = time.perf_counter() - start
+                metrics.observe('sma_request_seconds', elapsed, **labels)
+                metrics.observe('sma_decode_seconds', decode, **labels)
+                metrics.count('sma_response_bytes_total', size, **labels)
+                breaker.success()
+                return body
+            except asyncio.TimeoutError:
+                metrics.count('sma_timeouts_total', **labels)
+            except IncompleteError:
+                # A reply cut short is retried like any other failed transfer
+                metrics.count('sma_errors_total', **labels)
+            except FormatError as e:
+                _LOGGER.warning(f"{self._url}: unexpected getLogger reply ({e}), no longer streaming replies")
+                metrics.count('sma_errors_total', **labels)
+                self._stream = False
+                parser = None
+            except (client_exceptions.ClientError, ValueError):
+                metrics.count('sma_errors_total', **labels)
+        metrics.count('sma_failures_total', **labels)
+        breaker.failure()
         return {'err': f"Could not connect to SMA at {self._url} (timeout)"}
 
-    async def _read_body(self, url, payload):
+    async def _stream_body(self, res, parser):
+        """Feed a reply to the parser as it arrives, returns (body, bytes, seconds spent parsing)."""
+        decode = 0.0
+        async for chunk in res.content.iter_chunked(STREAM_CHUNK):
+            start = time.perf_counter()
+            parser.feed(chunk)
+            decode += time.perf_counter() - start
+        start = time.perf_counter()
+        body = parser.finish() or {}
+        decode += time.perf_counter() - start
+        return body, parser.size, decode
+
+    async def _read_body(self, url, payload, parser=None):
         if self.sma_sid is None and self._new_session_data is not None:
             await self.new_session()
             if self.sma_sid is None:
                 _LOGGER.debug(f"Unable to create new session with inverter {self._url}")
                 raise SmaException(SmaException.NO_SESSION)
 
-        body = await self._fetch_json(url, payload=payload)
+        body = await self._fetch_json(url, payload=payload, parser=parser)
 
-        # On the first error we close the session which will re-login
+        # The inverter replies with an error code (401) when a kept session expired or was
+        # dropped, log in again and repeat the request once, our own connection failures are text
         err = body.get('err')
+        if err is not None and not isinstance(err, str) and self._new_session_data is not None:
+            if fastjson.debug_enabled():
+                _LOGGER.debug(f"{self._url}: session error {err}, logging in again")
+            self.sma_sid = None
+            await self.new_session()
+            body = await self._fetch_json(url, payload=payload, parser=parser)
+            err = body.get('err')
+
+        # On a remaining error we close the session which will re-login
         if err is not None:
-            _LOGGER.debug(
-                f"{self._url}: error detected, closing session to force another login attempt, got: {body}",
-            )
+            if fastjson.debug_enabled():
+                _LOGGER.debug(
+                    f"{self._url}: error detected, closing session to force another login attempt, got: {body}",
+                )
             await self.close_session()
             raise SmaException(SmaException.ERR_RETURNED)
 
         if not isinstance(body, dict) or 'result' not in body:
-            _LOGGER.debug(f"No 'result' in reply from SMA, got: {body}")
+            if fastjson.debug_enabled():
+                _LOGGER.debug(f"No 'result' in reply from SMA, got: {body}")
             raise SmaException(SmaException.NO_RESULT)
 
         if self.sma_uid is None:
@@ -97,7 +198,8 @@ class SMA:
 
         result_body = body['result'].pop(self.sma_uid, None)
         if body != {'result': {}}:
-            _LOGGER.debug(f"Unexpected body {json.dumps(body)}, extracted {json.dumps(result_body)}")
+            if fastjson.debug_enabled():
+                _LOGGER.debug(f"Unexpected body {fastjson.dumps(body)}, extracted {result_body!r}")
             raise SmaException(SmaException.UNEXPECTED_BODY)
 
         return result_body
@@ -107,18 +209,19 @@ class SMA:
         body = await self._fetch_json(URL_LOGIN, self._new_session_data)
         self.sma_sid = jmespath.search('result.sid', body)
         if self.sma_sid:
+            self.logins += 1
             return
 
         err = body.pop('err', None)
-        msg = f"Could not start session, {body}, got {{}}"
+        msg = f"Could not start session, {body}, got "
         if err:
             if err == 503:
-                _LOGGER.debug(msg, "Max amount of sessions reached")
+                _LOGGER.debug(msg + "Max amount of sessions reached")
                 raise SmaException(SmaException.MAX_SESSIONS)
-            _LOGGER.debug(msg, err)
-            raise SmaException(SmaException.START_SESSION, msg)
+            _LOGGER.debug(msg + str(err))
+            raise SmaException(SmaException.START_SESSION)
         else:
-            _LOGGER.debug(msg, "Session ID expected [result.sid]")
+            _LOGGER.debug(msg + "Session ID expected [result.sid]")
             raise SmaException(SmaException.SESSION_ID_EXPECTED)
 
     async def close_session(self):
@@ -141,16 +244,28 @@ class SMA:
         result_body = await self._read_body(URL_ONLINE, payload)
         return result_body
 
+    def cached(self, key, start, end):
+        """Return a getLogger window from the response cache as a Series, None if it isn't cached."""
+        if self._cache:
+            return self._cache.get(self._url, key, start, end)
+        return None
+
+    async def read_logger(self, key, start, end):
+        """Read a getLogger window from the inverter as a Series and add it to the response cache."""
+        payload = {'destDev': [], 'key': key, 'tStart': start, 'tEnd': end}
+        history = await self._read_body(URL_LOGGER, payload, parser=LoggerParser)
+        if not isinstance(history, Series):
+            history = Series.from_records(None, history or [])
+        if self._cache:
+            self._cache.put(self._url, key, start, end, history)
+        return history
+
     async def read_history(self, start, end):
         """Read the history for the specified period."""
         # {'destDev':[],'key':28704,'tStart':1601521200,'tEnd':1604217600}.
-        payload = {'destDev': [], 'key': 28704, 'tStart': start, 'tEnd': end}
-        result_body = await self._read_body(URL_LOGGER, payload)
-        return result_body
+        return await self.read_logger(KEY_DAILY_HISTORY, start, end)
 
     async def read_fine_history(self, start, end):
         """Read the fine history for the specified period."""
         # {'destDev':[],'key':28672,'tStart':1601521200,'tEnd':1604217600}.
-        payload = {'destDev': [], 'key': 28672, 'tStart': start, 'tEnd': end}
-        result_body = await self._read_body(URL_LOGGER, payload)
-        return result_body
+        return await self.read_logger(KEY_FINE_HISTORY, start, end)
@@ -0,0 +1,38 @@
+"""JSON state files kept between runs, replaced in one step so an interrupted save never leaves a partial file."""
+
+import json
+import logging
+import os
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+
+def path(filename, default):
+    """Absolute path of a state file option, 'default' in the current directory if the option isn't set."""
+    return os.path.abspath(os.path.expanduser(filename or default))
+
+
+def load(filename, description):
+    """Return the state saved in a file, an empty dict if there is none or it can't be read."""
+    try:
+        with open(filename) as f:
+            state = json.load(f)
+        _LOGGER.info(f"Loaded {description} from {filename}")
+        return state
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        _LOGGER.error(f"Unable to read {description} from {filename}: {e}")
+    return {}
+
+
+def save(filename, state, description):
+    """Replace the state saved in a file."""
+    try:
+        temporary = filename + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(temporary, filename)
+    except Exception as e:
+        _LOGGER.error(f"Unable to save {description} to {filename}: {e}")
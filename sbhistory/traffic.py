@@ -0,0 +1,106 @@
+"""Record the inverter traffic of a run and replay it later without the inverters."""
+
+import asyncio
+import gzip
+import json
+import logging
+import time
+from collections import defaultdict, deque
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+_DEFAULT_TRAFFIC_FILE = 'sbhistory_traffic.jsonl.gz'
+
+TRAFFIC_VERSION = 1
+
+
+def request_key(base_url, url, payload):
+    """Identify a request, the password is never part of the key or the recording."""
+    payload = {k: v for k, v in (payload or {}).items() if k != 'pass'}
+    return f"{base_url}{url} {json.dumps(payload, sort_keys=True, separators=(',', ':'))}"
+
+
+class Recorder:
+    """Class to record every request and response made by SMA._fetch_json().
+
+    The exchanges are written as gzip compressed JSON lines, one per request in
+    the order they completed, with the time taken by the inverter.
+    """
+
+    def __init__(self, filename=None):
+        """Create a new Recorder object and open the recording."""
+        self._filename = filename or _DEFAULT_TRAFFIC_FILE
+        self._file = gzip.open(self._filename, 'wt')
+        self._file.write(json.dumps({'version': TRAFFIC_VERSION, 'created': time.time()}) + '\n')
+        self._start = time.monotonic()
+        self._exchanges = 0
+        _LOGGER.info(f"Recording the inverter traffic to {self._filename}")
+
+    async def exchange(self, base_url, url, payload, fetch):
+        """Make the request with fetch() and record the response."""
+        offset = time.monotonic() - self._start
+        body = await fetch()
+        elapsed = time.monotonic() - self._start - offset
+        record = {
+            'key': request_key(base_url, url, payload),
+            'offset': round(offset, 4),
+            'elapsed': round(elapsed, 4),
+            'response': body,
+        }
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._exchanges += 1
+        return body
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            _LOGGER.info(f"Recorded {self._exchanges} inverter exchanges to {self._filename}")
+
+
+class Player:
+    """Class to answer SMA._fetch_json() requests from a recording.
+
+    Identical requests are answered in the order they were recorded, with
+    'original' timing a request isn't answered before its offset from the start
+    of the recording, and then takes as long as the inverter took, so the gaps
+    between the requests are kept too. With 'fast' timing the answers are immediate.
+    """
+
+    def __init__(self, filename=None, timing='fast'):
+        """Create a new Player object and load the recording."""
+        self._filename = filename or _DEFAULT_TRAFFIC_FILE
+        self._original = timing == 'original'
+        self._responses = defaultdict(deque)
+        self._replayed = 0
+        self._missing = 0
+        self._start = time.monotonic()
+        with gzip.open(self._filename, 'rt') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != TRAFFIC_VERSION:
+                _LOGGER.warning(f"Traffic file {self._filename} is version {header.get('version')}")
+            count = 0
+            for line in f:
+                record = json.loads(line)
+                self._responses[record['key']].append((record['offset'], record['elapsed'], record['response']))
+                count += 1
+        _LOGGER.info(f"Replaying {count} inverter exchanges from {self._filename} ({timing} timing)")
+
+    async def exchange(self, base_url, url, payload, fetch):
+        """Return the recorded response to a request, fetch() is never called."""
+        responses = self._responses.get(request_key(base_url, url, payload))
+        if not responses:
+            self._missing += 1
+            _LOGGER.debug(f"No recorded response for {base_url}{url}")
+            return {'err': f"No recorded response for {base_url}{url}"}
+        offset, elapsed, body = responses.popleft()
+        if self._original:
+            # A request made later than it was recorded isn't delayed any further
+            wait = self._start + offset - time.monotonic()
+            await asyncio.sleep(max(0.0, wait) + elapsed)
+        self._replayed += 1
+        return body
+
+    def close(self):
+        _LOGGER.info(f"Replayed {self._replayed} inverter exchanges, {self._missing} requests were not recorded")
@@ -0,0 +1,95 @@
+"""Size the fine history requests from how fast each inverter answers.
+
+Windows are a power of two days aligned on a grid starting at the configured
+start date, so the request boundaries are the same from run to run and the
+response cache and recorded traffic keep matching.
+"""
+
+import logging
+
+
+_LOGGER = logging.getLogger('sbhistory')
+
+# Defaults for the 'fine_history.window' options
+DEFAULT_MAX_DAYS = 16
+DEFAULT_TARGET_SECONDS = 1.5
+DEFAULT_MAX_RECORDS = 4608
+
+# Weight of the newest observation in the running averages
+SMOOTHING = 0.5
+
+
+def grid_days(days):
+    """Return the largest power of two not above 'days' (at least 1)."""
+    return 1 << (max(1, int(days)).bit_length() - 1)
+
+
+def aligned_days(offset, days, remaining):
+    """Return the size of the request starting 'offset' days into the grid.
+
+    The size is at most 'days' and 'remaining' and is a power of two that
+    divides the offset, so a window never straddles a larger grid window.
+    """
+    size = grid_days(min(days, remaining))
+    while offset % size:
+        size //= 2
+    return size
+
+
+class AdaptiveWindow:
+    """Class to choose the number of days of 5 minute history requested from one inverter.
+
+    The window doubles while the inverter answers within the target time and
+    the expected number of records stays under max_records, it is sized down
+    when a request is slow and halved when a request fails (usually a timeout).
+    With timed=False the response times are ignored so the windows only depend
+    on the data, used when the replies are cached or recorded.
+    """
+
+    def __init__(self, name, max_days=DEFAULT_MAX_DAYS, target=DEFAULT_TARGET_SECONDS,
+                 max_records=DEFAULT_MAX_RECORDS, timed=True):
+        """Create a new AdaptiveWindow object starting at one day."""
+        self.name = name
+        self.max_days = grid_days(max_days)
+        self.target = target
+        self.timed = timed
+        self.max_records = max_records
+        self.days = 1
+        self.requests = 0
+        self.failures = 0
+        self._seconds_per_day = None
+        self._records_per_day = None
+
+    def _average(self, previous, value):
+        return value if previous is None else SMOOTHING * value + (1 - SMOOTHING) * previous
+
+    def observe(self, days, elapsed, records):
+        """Update the window after a successful request of 'days' days."""
+        self.requests += 1
+        self._seconds_per_day = self._average(self._seconds_per_day, elapsed / days)
+        self._records_per_day = self._average(self._records_per_day, records / days)
+
+        limit = self.max_days
+        if self.timed and self._seconds_per_day > 0:
+            limit = min(limit, int(self.target / self._seconds_per_day))
+        if self._records_per_day > 0:
+            limit = min(limit, int(self.max_records / self._records_per_day))
+        # A request cut short by the grid or the end date doesn't shrink the window
+        grow = 2 * self.days if days >= self.days else self.days
+        self.days = grid_days(min(grow, limit))
+
+    def failed(self, days):
+        """Halve the window after a failed request of 'days' days."""
+        self.requests += 1
+        self.failures += 1
+        self.days = max(1, days // 2)
+        _LOGGER.debug(f"Inverter '{self.name}' failed a {days} day request, window is now {self.days} day(s)")
+
+    def report(self):
+        if not self.requests:
+            return
+        seconds = self._seconds_per_day or 0.0
+        _LOGGER.info(
+            f"Fine history '{self.name}': {self.requests} requests, {self.failures} failed, "
+            f"window {self.days} day(s), {seconds * 1000:.0f} ms per day"
+        )
@@ -27,9 +27,14 @@ setup(
         "paho-mqtt",
         "astral",
         "pysolar",
+        "numpy",
         "python-dateutil",
         "python-configuration",
         "pyyaml",
     ],
+    extras_require={
+        "fast": ["orjson"],
+        "profile": ["pyinstrument"],
+    },
     zip_safe=True,
 )